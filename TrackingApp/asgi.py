@@ -5,6 +5,17 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
+
+The live tracking stream (/api/stream-location/<id>/) holds one connection
+per watcher and needs this entry point, e.g.:
+
+    uvicorn TrackingApp.asgi:application
+
+Served through wsgi.py the endpoint answers 406 and the tracking page falls
+back to polling.
+
+Watchers are fanned out by an in-process broker (main.broker), so location
+updates must be posted to the same process that serves the streams.
 """
 
 import os
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,21 +42,24 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    'main.middleware.StaticFilesMiddleware',  # WhiteNoise, async-capable
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'main.routing.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'main.middleware.ViewTimerMiddleware',
 ]
 
 ROOT_URLCONF = 'TrackingApp.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'main.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -88,6 +92,77 @@ DATABASES = {
     }
 }
 
+# Read replicas
+# Set DATABASE_REPLICA_HOSTS to a comma-separated list of hosts that replicate
+# the primary. Each becomes a replica1, replica2, ... alias with the primary's
+# credentials, and views marked with main.routing.replica_reads read from
+# them. A client that has just written stays on the primary for
+# DATABASE_REPLICA_PIN_SECONDS so it reads its own writes.
+#
+# Run the tests without DATABASE_REPLICA_HOSTS: a test mirror is a second
+# connection and cannot see rows a TestCase has not committed. Routing is
+# tested against the 'replica' alias below, which mirrors the test database
+# and is left out of DATABASE_REPLICAS, so nothing else reads from it.
+
+for number, host in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'TEST': {'MIRROR': 'default'},
+}
+DATABASE_REPLICA_PIN_SECONDS = 5
+DATABASE_ROUTERS = ['main.routing.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# Local memory by default. Set REDIS_URL (e.g. redis://localhost:6379/0) to
+# share cached order snapshots between processes (needs the redis package).
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'trackflow',
+            'OPTIONS': {
+                'MAX_ENTRIES': 50000,
+            },
+        }
+    }
+
+# Prebuilt get_order_location responses (main/snapshots.py). Writes rebuild
+# them in place, so they can live well past the polling interval, but only
+# if every worker sees the same cache: ORDER_SNAPSHOT_CACHE must be a shared
+# backend (set REDIS_URL) when running more than one worker. The local memory
+# fallback is for single-process development and fails check main.W001.
+ORDER_SNAPSHOT_CACHE = 'default'
+
+ORDER_SNAPSHOT_TTL = 300
+
+
+# Authentication
+# Loads each request's user and profile in one query (main/auth.py).
+# ModelBackend stays listed so that sessions created before ProfileBackend,
+# which store its path, remain valid.
+
+AUTHENTICATION_BACKENDS = [
+    'main.auth.ProfileBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -132,4 +207,117 @@ STORAGES = {
     "staticfiles": {
         "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
     },
-}
\ No newline at end of file
+}
+
+# Location ingestion
+# With write-behind enabled, rider fixes are buffered in memory and written in
+# bulk every LOCATION_FLUSH_INTERVAL seconds or once LOCATION_FLUSH_SIZE fixes
+# are waiting. See main/write_behind.py.
+
+LOCATION_WRITE_BEHIND = False
+
+LOCATION_FLUSH_INTERVAL = 2.0
+
+LOCATION_FLUSH_SIZE = 500
+
+# Remaining distance, speed and ETA reported by the tracking APIs. Speed is
+# averaged over the last ETA_WINDOW_SECONDS of fixes (at most
+# ETA_WINDOW_FIXES of them); per-order state lives in the snapshot cache for
+# ETA_STATE_TTL seconds. See main/eta.py.
+
+ETA_WINDOW_SECONDS = 300
+
+ETA_WINDOW_FIXES = 30
+
+ETA_STATE_TTL = 3600
+
+# Geofences around each dispatched order's pickup and drop-off (radii in
+# metres). A rider counts as having left once further than
+# GEOFENCE_EXIT_FACTOR times the radius. With GEOFENCE_AUTO_DELIVER, staying
+# inside the drop-off fence for GEOFENCE_DWELL_SECONDS marks the order
+# delivered. Which fences each order is inside is kept in the snapshot cache
+# for GEOFENCE_STATE_TTL seconds, so it needs the same shared cache as the
+# snapshots; each process also keeps the fences of up to GEOFENCE_MAX_ORDERS
+# orders. See main/geofence.py.
+
+GEOFENCE_PICKUP_RADIUS_M = 75
+
+GEOFENCE_DELIVERY_RADIUS_M = 50
+
+GEOFENCE_EXIT_FACTOR = 1.5
+
+GEOFENCE_AUTO_DELIVER = False
+
+GEOFENCE_DWELL_SECONDS = 30
+
+GEOFENCE_STATE_TTL = 3600
+
+GEOFENCE_MAX_ORDERS = 10000
+
+# Next-report interval returned to rider devices (seconds). Riders aim for a
+# fix every REPORT_SPACING_FRACTION of the distance to their next stop,
+# clamped to REPORT_SPACING_MIN_M..REPORT_SPACING_MAX_M. Above
+# REPORT_TARGET_FIXES_PER_SECOND per process, intervals stretch in
+# proportion. See main/reporting.py.
+
+REPORT_INTERVAL_MIN = 5
+
+REPORT_INTERVAL_MAX = 60
+
+REPORT_SPACING_FRACTION = 0.1
+
+REPORT_SPACING_MIN_M = 30
+
+REPORT_SPACING_MAX_M = 500
+
+REPORT_TARGET_FIXES_PER_SECOND = 200
+
+# The fleet snapshot (/api/fleet/) is kept in memory by each process and
+# reloaded from the database every FLEET_REFRESH_SECONDS to pick up fixes
+# ingested elsewhere. See main/fleet.py.
+
+FLEET_REFRESH_SECONDS = 30
+
+# Douglas-Peucker tolerance, in metres, used when compacting delivered orders'
+# location history into encoded tracks (manage.py compact_tracks).
+
+TRACK_SIMPLIFY_TOLERANCE_M = 5.0
+
+# Retention of raw location history (manage.py prune_locations). Fixes older
+# than LOCATION_RETENTION_DAYS on orders in LOCATION_RETENTION_STATUSES are
+# folded into the order's compressed track, then deleted
+# LOCATION_RETENTION_BATCH_SIZE rows per transaction. See main/retention.py.
+
+LOCATION_RETENTION_DAYS = 30
+
+LOCATION_RETENTION_STATUSES = ['delivered']
+
+LOCATION_RETENTION_BATCH_SIZE = 1000
+
+# Request instrumentation (main/middleware.py). Every response carries a
+# Server-Timing header with DB, view, template and total time; requests slower
+# than PERFORMANCE_SLOW_REQUEST_MS are logged as warnings on main.performance.
+# Per-URL histograms are served to staff at /metrics/.
+
+PERFORMANCE_SERVER_TIMING = True
+
+PERFORMANCE_SLOW_REQUEST_MS = 500
+
+# Automatic assignment (manage.py auto_dispatch). Each tick matches pending
+# orders to available riders whose position is at most
+# AUTO_DISPATCH_POSITION_MAX_AGE seconds old and who have fewer than
+# AUTO_DISPATCH_MAX_ACTIVE_ORDERS deliveries in progress. See main/dispatcher.py.
+
+AUTO_DISPATCH_INTERVAL = 10
+
+AUTO_DISPATCH_BUDGET_MS = 1000
+
+AUTO_DISPATCH_MAX_DISTANCE_KM = 10.0
+
+AUTO_DISPATCH_CANDIDATES = 5
+
+AUTO_DISPATCH_MAX_ACTIVE_ORDERS = 1
+
+AUTO_DISPATCH_POSITION_MAX_AGE = 600
+
+AUTO_DISPATCH_MAX_ORDERS = 5000
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class MainConfig(AppConfig):
     name = 'main'
+
+    def ready(self):
+        # Connect signal receivers
+        from . import broker, fleet, snapshots, spatial  # noqa: F401
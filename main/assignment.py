@@ -0,0 +1,80 @@
+from django.db import transaction
+from django.db.models import Case, When, Value
+from django.utils import timezone
+
+from .models import Order
+from .rider_stats import record_accepted
+from .snapshots import invalidate_snapshot
+from .spatial import available_orders
+
+# Orders per UPDATE in claim_orders
+CLAIM_CHUNK_SIZE = 500
+
+
+def claim_order(order_id, rider):
+    """
+    Assign a pending order to rider with one conditional UPDATE.
+
+    The WHERE clause only matches while the order is still pending and
+    unassigned, so when several riders race for the same order the database
+    lets exactly one UPDATE through. Returns True if this rider won.
+    """
+    won = Order.objects.filter(
+        id=order_id,
+        status='pending',
+        assigned_dispatch__isnull=True,
+    ).update(
+        assigned_dispatch=rider,
+        status='dispatched',
+        accepted_at=timezone.now(),
+    )
+    if won:
+        # update() skips post_save, so do its bookkeeping here
+        available_orders.discard(order_id)
+        invalidate_snapshot(order_id)
+        record_accepted(rider.id)
+    return bool(won)
+
+
+def claim_orders(assignments):
+    """
+    Assign many pending orders at once: {order_id: rider_id}.
+
+    One UPDATE sets every order's rider through a CASE, guarded by the same
+    pending-and-unassigned condition as claim_order, so orders a rider took
+    in the meantime are left alone. Returns the {order_id: rider_id} pairs
+    that were applied.
+    """
+    if not assignments:
+        return {}
+    accepted_at = timezone.now()
+    pairs = list(assignments.items())
+    with transaction.atomic():
+        # Chunked to keep each statement's parameter count bounded
+        for start in range(0, len(pairs), CLAIM_CHUNK_SIZE):
+            chunk = pairs[start:start + CLAIM_CHUNK_SIZE]
+            Order.objects.filter(
+                id__in=[order_id for order_id, _ in chunk],
+                status='pending',
+                assigned_dispatch__isnull=True,
+            ).update(
+                assigned_dispatch=Case(*[When(id=order_id, then=Value(rider_id)) for order_id, rider_id in chunk]),
+                status='dispatched',
+                accepted_at=accepted_at,
+            )
+    # accepted_at tells our rows apart from concurrent claims
+    won = {}
+    for start in range(0, len(pairs), CLAIM_CHUNK_SIZE):
+        rows = (
+            Order.objects
+            .filter(id__in=[order_id for order_id, _ in pairs[start:start + CLAIM_CHUNK_SIZE]],
+                    accepted_at=accepted_at)
+            .values_list('id', 'assigned_dispatch_id')
+        )
+        won.update((order_id, rider_id) for order_id, rider_id in rows if assignments[order_id] == rider_id)
+    for order_id in won:
+        available_orders.discard(order_id)
+        invalidate_snapshot(order_id)
+    for rider_id in set(won.values()):
+        record_accepted(rider_id, sum(1 for winner in won.values() if winner == rider_id))
+    return won
@@ -0,0 +1,97 @@
+from functools import wraps
+
+from django.contrib import messages
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+from django.http import JsonResponse
+from django.shortcuts import redirect
+
+# Authentication helpers shared by the views.
+#
+# ProfileBackend loads the session's user together with its UserProfile in
+# one joined query, so request.user.profile never costs a second one. The
+# user's role is also kept in the session from login onwards. Whenever the
+# profile came with the user, the session copy is checked against it, so a
+# saved change of user_type takes effect on the user's next request. Only
+# sessions from before ProfileBackend (still served by ModelBackend, without
+# the join) rely on the session copy alone until they log in again.
+
+ROLE_SESSION_KEY = 'user_role'
+
+UserModel = get_user_model()
+
+
+class ProfileBackend(ModelBackend):
+    """ModelBackend that fetches the profile in the same query as the user"""
+
+    def get_user(self, user_id):
+        try:
+            user = UserModel._default_manager.select_related('profile').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        try:
+            user = await UserModel._default_manager.select_related('profile').aget(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+
+def _role_of(user):
+    profile = getattr(user, 'profile', None)
+    return profile.user_type if profile is not None else 'user'
+
+
+@receiver(user_logged_in)
+def remember_role(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, 'session'):
+        request.session[ROLE_SESSION_KEY] = _role_of(user)
+
+
+def user_role(request):
+    """Role of the logged-in user ('user' or 'dispatch'), cached in the session"""
+    role = request.session.get(ROLE_SESSION_KEY)
+    if role is None or UserModel.profile.related.is_cached(request.user):
+        # Free when ProfileBackend joined the profile in; catches user_type changes
+        fresh = _role_of(request.user)
+        if fresh != role:
+            role = request.session[ROLE_SESSION_KEY] = fresh
+    return role
+
+
+def request_rider(request):
+    """The dispatch rider making the request, or None for anyone else"""
+    if request.user.is_authenticated and user_role(request) == 'dispatch':
+        return request.user
+    return None
+
+
+def redirect_home(request):
+    """Send a logged-in user to the dashboard for their role"""
+    if user_role(request) == 'dispatch':
+        return redirect('dispatch_dashboard')
+    return redirect('dashboard')
+
+
+def role_required(role, message='Access denied.', api=False):
+    """
+    login_required plus a role check. Users with another role get a 403 JSON
+    error when api is set, otherwise message and a redirect to the dashboard.
+    """
+    def decorator(view):
+        @login_required(login_url='login')
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if user_role(request) != role:
+                if api:
+                    return JsonResponse({'success': False, 'error': 'Access denied'}, status=403)
+                messages.error(request, message)
+                return redirect('dashboard')
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,103 @@
+import threading
+import uuid
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+
+from .models import Order, UserProfile
+
+# Helpers shared by the benchmark management commands.
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Thread-safe per-endpoint samples of latency, query count and status"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(list)
+
+    def add(self, endpoint, seconds, queries=None, status=200):
+        with self._lock:
+            self._samples[endpoint].append((seconds, queries, status))
+
+    def summary(self, wall_seconds):
+        """Per-endpoint dict of count, errors, throughput, latency percentiles (ms) and queries"""
+        report = {}
+        with self._lock:
+            samples = dict(self._samples)
+        for endpoint, rows in sorted(samples.items()):
+            latencies = sorted(seconds for seconds, _, _ in rows)
+            queries = [count for _, count, _ in rows if count is not None]
+            report[endpoint] = {
+                'requests': len(rows),
+                'errors': sum(1 for _, _, status in rows if status >= 400),
+                'throughput': round(len(rows) / wall_seconds, 1) if wall_seconds else 0.0,
+                'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+                'queries': round(sum(queries) / len(queries), 2) if queries else None,
+            }
+        return report
+
+
+def write_report(stdout, report):
+    header = f"{'endpoint':<24}{'reqs':>8}{'err':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}"
+    stdout.write(header)
+    stdout.write('-' * len(header))
+    for endpoint, row in report.items():
+        queries = '-' if row['queries'] is None else f"{row['queries']:.1f}"
+        stdout.write(
+            f"{endpoint:<24}{row['requests']:>8}{row['errors']:>6}{row['throughput']:>10.1f}"
+            f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}{queries:>9}"
+        )
+
+
+class Fixture:
+    """Throwaway customers, riders and dispatched orders tagged for clean-up"""
+
+    def __init__(self, customers, riders, orders_per_customer=1):
+        self.tag = f'bench-{uuid.uuid4().hex[:8]}'
+        self.customers = User.objects.bulk_create(
+            User(username=f'{self.tag}-customer-{i}') for i in range(customers)
+        )
+        self.riders = User.objects.bulk_create(
+            User(username=f'{self.tag}-rider-{i}') for i in range(riders)
+        )
+        # bulk_create skips the post_save receiver that normally adds profiles
+        UserProfile.objects.bulk_create(
+            [UserProfile(user=user) for user in self.customers]
+            + [UserProfile(user=user, user_type='dispatch') for user in self.riders]
+        )
+
+        orders = []
+        for i, customer in enumerate(self.customers * orders_per_customer):
+            orders.append(Order(
+                user=customer,
+                name=f'{self.tag}-{i}',
+                description='Benchmark order',
+                status='dispatched' if riders else 'pending',
+                assigned_dispatch=self.riders[i % riders] if riders else None,
+                pickup_latitude=6.5,
+                pickup_longitude=3.35,
+                delivery_latitude=6.6,
+                delivery_longitude=3.4,
+            ))
+        self.orders = Order.objects.bulk_create(orders)
+
+    def orders_for_rider(self, rider):
+        return [order for order in self.orders if order.assigned_dispatch_id == rider.id]
+
+    def orders_for_customer(self, customer):
+        return [order for order in self.orders if order.user_id == customer.id]
+
+    def delete(self):
+        # Cascades to orders, history and profiles
+        User.objects.filter(username__startswith=f'{self.tag}-').delete()
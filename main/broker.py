@@ -0,0 +1,79 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.dispatch import receiver
+
+from .models import Order
+from .signals import locations_recorded
+
+# In-process pub/sub used by the live tracking stream. Watchers subscribe to
+# an order id and are woken only when ingestion records a new position, so an
+# idle stream costs no DB queries. Subscribers live in this process only: run
+# a single ASGI worker, or put a shared broker in front of several.
+
+
+class LocationBroker:
+    """Fan out encoded location events to the streams watching each order"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, order_id):
+        """Register a stream on the running event loop and return its queue"""
+        # Only the newest position matters, so a slow watcher keeps one event
+        queue = asyncio.Queue(maxsize=1)
+        entry = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers[order_id].add(entry)
+        return entry
+
+    def unsubscribe(self, order_id, entry):
+        with self._lock:
+            watchers = self._subscribers.get(order_id)
+            if watchers is not None:
+                watchers.discard(entry)
+                if not watchers:
+                    del self._subscribers[order_id]
+
+    def watcher_count(self, order_id=None):
+        with self._lock:
+            if order_id is not None:
+                return len(self._subscribers.get(order_id, ()))
+            return sum(len(watchers) for watchers in self._subscribers.values())
+
+    def publish(self, order_id, payload):
+        """Encode payload once and hand it to every watcher; safe from any thread"""
+        with self._lock:
+            watchers = list(self._subscribers.get(order_id, ()))
+        if not watchers:
+            return
+        event = encode_event(payload)
+        for loop, queue in watchers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # The watcher's loop has shut down; its stream is gone
+                self.unsubscribe(order_id, (loop, queue))
+
+
+def encode_event(payload):
+    return f"data: {json.dumps(payload, separators=(',', ':'))}\n\n".encode()
+
+
+def _offer(queue, event):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+broker = LocationBroker()
+
+
+@receiver(locations_recorded, sender=Order)
+def publish_recorded_locations(sender, orders, **kwargs):
+    for order in orders:
+        if broker.watcher_count(order.id):
+            broker.publish(order.id, {'success': True, **order.location_payload()})
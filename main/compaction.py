@@ -0,0 +1,118 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import LocationUpdate, CompressedTrack
+from .polyline import simplify, encode_polyline, encode_values, decode_polyline, decode_values
+
+
+def default_tolerance():
+    return getattr(settings, 'TRACK_SIMPLIFY_TOLERANCE_M', 5.0)
+
+
+def compact_order(order, tolerance_m=None):
+    """
+    Fold an order's raw LocationUpdate rows into its CompressedTrack.
+
+    The track is simplified with Douglas-Peucker and stored as two encoded
+    strings, then the raw rows that went into it are deleted. Fixes that
+    arrive later are appended by the next run. Returns the track, or None if
+    there was nothing to compact.
+    """
+    if tolerance_m is None:
+        tolerance_m = default_tolerance()
+
+    rows = list(
+        LocationUpdate.objects
+        .filter(order=order)
+        .order_by('timestamp', 'id')
+        .values_list('id', 'latitude', 'longitude', 'timestamp')
+    )
+    if not rows:
+        return None
+
+    last_id = max(row[0] for row in rows)
+    with transaction.atomic():
+        track = fold_into_track(order, rows, tolerance_m)
+        # Only the rows read above; anything newer waits for the next run
+        LocationUpdate.objects.filter(order=order, id__lte=last_id).delete()
+
+    return track
+
+
+def fold_into_track(order, rows, tolerance_m):
+    """
+    Fold (id, latitude, longitude, timestamp) rows into the order's track.
+
+    Writes the track only; deleting the rows is left to the caller. Points
+    already in the track are never simplified again, so no raw fix ends up
+    further than tolerance_m from the track. Rows newer than the track's
+    archived_until are simplified as one new segment, anchored on the
+    track's last kept point, and appended. Late rows, at or before
+    archived_until, are inserted as they are.
+    """
+    kept = []
+    archived_until = None
+    raw_count = len(rows)
+    existing = CompressedTrack.objects.filter(order=order).first()
+    if existing is not None:
+        kept = [
+            (lat, lng, ts)
+            for (lat, lng), ts in zip(decode_polyline(existing.points), decode_values(existing.times))
+        ]
+        raw_count += existing.raw_point_count
+        archived_until = existing.archived_until
+        if archived_until is None and kept:
+            # Tracks from before archived_until end at their last point
+            archived_until = datetime.fromtimestamp(kept[-1][2], dt_timezone.utc)
+
+    late = [_point(row) for row in rows if archived_until is not None and row[3] <= archived_until]
+    new = [row for row in rows if archived_until is None or row[3] > archived_until]
+    if new:
+        anchor = kept[-1:]
+        kept += simplify(anchor + [_point(row) for row in new], tolerance_m)[len(anchor):]
+        archived_until = max(row[3] for row in new)
+    if late:
+        kept = sorted(kept + late, key=lambda point: point[2])
+
+    track, _ = CompressedTrack.objects.update_or_create(
+        order=order,
+        defaults={
+            'points': encode_polyline((lat, lng) for lat, lng, _ in kept),
+            'times': encode_values(ts for _, _, ts in kept),
+            'point_count': len(kept),
+            'raw_point_count': raw_count,
+            'tolerance_m': tolerance_m,
+            'archived_until': archived_until,
+        },
+    )
+    return track
+
+
+def _point(row):
+    _, lat, lng, ts = row
+    return float(lat), float(lng), int(ts.timestamp())
+
+
+def encode_raw_history(order):
+    """Encode an order's uncompacted history in the same format as CompressedTrack"""
+    rows = list(
+        LocationUpdate.objects
+        .filter(order=order)
+        .order_by('timestamp', 'id')
+        .values_list('latitude', 'longitude', 'timestamp')
+    )
+    return {
+        'points': encode_polyline((lat, lng) for lat, lng, _ in rows),
+        'times': encode_values(int(ts.timestamp()) for _, _, ts in rows),
+        'point_count': len(rows),
+    }
+
+
+def track_payload(track):
+    return {
+        'points': track.points,
+        'times': track.times,
+        'point_count': track.point_count,
+    }
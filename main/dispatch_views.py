@@ -198,6 +198,7 @@ def complete_delivery(request, order_id):
         return redirect('dispatch_dashboard')
     
     order.status = 'delivered'
+    order.delivered_at = timezone.now()
     order.save()
     
     # Update dispatch rider stats
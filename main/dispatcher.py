@@ -0,0 +1,120 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .assignment import claim_orders
+from .models import Order, UserProfile
+from .spatial import GridIndex
+
+logger = logging.getLogger(__name__)
+
+# Automatic batch assignment of pending orders to available riders.
+#
+# Each tick loads the pending, unassigned orders (oldest first) and the
+# riders who are available, have reported a position recently and have room
+# for another job. Riders go into a GridIndex, each order asks it for its
+# AUTO_DISPATCH_CANDIDATES nearest riders, and the resulting (distance,
+# order, rider) pairs are matched greedily, shortest first. That costs
+# O(orders * candidates * log) rather than the O(n^3) of an exact Hungarian
+# solve, which is what lets a tick cover thousands of orders; in a city-scale
+# grid the greedy matching is close to optimal because each order's nearest
+# riders are rarely contested. Orders left over when the time budget runs
+# out simply wait for the next tick.
+#
+# The chosen pairs are applied with claim_orders, whose guarded UPDATE skips
+# orders a rider accepted by hand in the meantime.
+
+
+def dispatch_setting(name, default):
+    return getattr(settings, f'AUTO_DISPATCH_{name}', default)
+
+
+def match(orders, riders, candidates=5, max_distance_km=10.0, deadline=None):
+    """
+    Greedy minimum-distance matching.
+
+    orders is a list of (order_id, lat, lng) in priority order and riders a
+    list of (rider_id, lat, lng, slots). Returns ({order_id: rider_id},
+    orders_considered). Stops looking at further orders once the
+    time.perf_counter() deadline has passed.
+    """
+    grid = GridIndex()
+    grid.replace((rider_id, lat, lng) for rider_id, lat, lng, _ in riders)
+    slots = {rider_id: free for rider_id, _, _, free in riders}
+
+    pairs = []
+    considered = 0
+    for order_id, lat, lng in orders:
+        if deadline is not None and considered % 100 == 0 and time.perf_counter() > deadline:
+            break
+        considered += 1
+        for distance, rider_id in grid.nearest(lat, lng, candidates):
+            if distance > max_distance_km:
+                break
+            # Ties go to the older order, which came first
+            pairs.append((distance, considered, order_id, rider_id))
+
+    pairs.sort()
+    assignments = {}
+    for _, _, order_id, rider_id in pairs:
+        if order_id in assignments or not slots[rider_id]:
+            continue
+        assignments[order_id] = rider_id
+        slots[rider_id] -= 1
+    return assignments, considered
+
+
+def dispatch_tick(budget_ms=None, max_distance_km=None, dry_run=False):
+    """Run one assignment round; returns a dict of what happened"""
+    started = time.perf_counter()
+    if budget_ms is None:
+        budget_ms = dispatch_setting('BUDGET_MS', 1000)
+    if max_distance_km is None:
+        max_distance_km = dispatch_setting('MAX_DISTANCE_KM', 10.0)
+    deadline = started + budget_ms / 1000
+    max_active = dispatch_setting('MAX_ACTIVE_ORDERS', 1)
+
+    fresh_since = timezone.now() - timedelta(seconds=dispatch_setting('POSITION_MAX_AGE', 600))
+    riders = [
+        (user_id, float(lat), float(lng), max_active - active)
+        for user_id, lat, lng, active in (
+            UserProfile.objects
+            .filter(user_type='dispatch', is_available=True, active_orders__lt=max_active,
+                    last_latitude__isnull=False, last_longitude__isnull=False,
+                    last_location_update__gte=fresh_since)
+            .values_list('user_id', 'last_latitude', 'last_longitude', 'active_orders')
+        )
+    ]
+
+    orders = []
+    if riders:
+        orders = [
+            (order_id, float(lat), float(lng))
+            for order_id, lat, lng in (
+                Order.objects
+                .filter(status='pending', assigned_dispatch__isnull=True,
+                        pickup_latitude__isnull=False, pickup_longitude__isnull=False)
+                .order_by('date_created', 'id')
+                .values_list('id', 'pickup_latitude', 'pickup_longitude')[:dispatch_setting('MAX_ORDERS', 5000)]
+            )
+        ]
+
+    assignments, considered = match(
+        orders, riders, dispatch_setting('CANDIDATES', 5), max_distance_km, deadline,
+    )
+    applied = assignments if dry_run else claim_orders(assignments)
+
+    result = {
+        'orders': len(orders),
+        'riders': len(riders),
+        'considered': considered,
+        'matched': len(assignments),
+        'assigned': len(applied),
+        'conflicts': len(assignments) - len(applied),
+        'ms': round((time.perf_counter() - started) * 1000, 1),
+    }
+    logger.info('Dispatch tick: %s', result)
+    return result
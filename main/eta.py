@@ -0,0 +1,214 @@
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import LocationUpdate
+
+try:
+    import numpy as np
+except ImportError:  # Optional: keeps the serverless bundle small
+    np = None
+
+# Remaining distance, recent speed and ETA for orders being delivered.
+#
+# Each order keeps a small progress state in the snapshot cache: its last
+# fix, the distance travelled so far and a window of (time, distance) marks
+# covering the last ETA_WINDOW_SECONDS (at most ETA_WINDOW_FIXES marks).
+# A new fix adds one segment and one mark and drops expired marks from the
+# front, so it costs O(1) whatever the length of the history. Average speed
+# is distance over time across the window.
+#
+# Ingestion calls attach_progress() once per request with all its fixes; the
+# segment lengths of every fix and the remaining distance of every order are
+# computed in one vectorized haversine call each (NumPy when installed, a
+# plain loop otherwise). An order with no state yet is seeded from its
+# LocationUpdate rows inside the window, in one query for all such orders.
+
+EARTH_RADIUS_M = 6371000.0
+
+# Slower than this (m/s) counts as stopped, and no ETA is given
+MIN_SPEED = 0.5
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _cache():
+    return caches[_setting('ORDER_SNAPSHOT_CACHE', 'default')]
+
+
+def _key(order_id):
+    return f'order-progress:{order_id}'
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distances in metres between equal-length coordinate sequences"""
+    if np is not None:
+        lat1, lng1, lat2, lng2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lng1, lat2, lng2))
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+        return (2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))).tolist()
+
+    distances = []
+    for a_lat, a_lng, b_lat, b_lng in zip(lat1, lng1, lat2, lng2):
+        a_lat, a_lng, b_lat, b_lng = map(math.radians, (a_lat, a_lng, b_lat, b_lng))
+        a = math.sin((b_lat - a_lat) / 2) ** 2 + math.cos(a_lat) * math.cos(b_lat) * math.sin((b_lng - a_lng) / 2) ** 2
+        distances.append(2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1.0))))
+    return distances
+
+
+def new_state():
+    return {'lat': None, 'lng': None, 'ts': None, 'travelled': 0.0, 'window': []}
+
+
+def advance(state, ts, lat, lng, segment_m):
+    """Fold one fix, segment_m metres from the previous one, into state"""
+    state['travelled'] += segment_m
+    state['lat'], state['lng'], state['ts'] = lat, lng, ts
+    window = state['window']
+    window.append((ts, state['travelled']))
+    horizon = ts - _setting('ETA_WINDOW_SECONDS', 300)
+    max_marks = _setting('ETA_WINDOW_FIXES', 30)
+    while len(window) > 2 and (window[0][0] < horizon or len(window) > max_marks):
+        window.pop(0)
+
+
+def speed(state):
+    """Average speed in m/s across the state's window, or None"""
+    window = state['window'] if state else None
+    if not window or len(window) < 2:
+        return None
+    (t0, d0), (t1, d1) = window[0], window[-1]
+    if t1 <= t0:
+        return None
+    return (d1 - d0) / (t1 - t0)
+
+
+def attach_progress(orders, fixes=(), seed=True):
+    """
+    Fold fixes into the orders' progress state and set order.progress.
+
+    order.progress is what Order.location_payload() reports: remaining
+    distance to the drop-off, recent speed and ETA, or None when the order is
+    not on its way or its position is unknown. With seed=False, orders with
+    no state start from the given fixes instead of their stored history.
+    """
+    if not orders:
+        return
+    cache = _cache()
+    ids = [order.id for order in orders]
+    stored = cache.get_many([_key(order_id) for order_id in ids])
+    states = {order_id: stored.get(_key(order_id)) for order_id in ids}
+
+    if fixes:
+        by_order = {}
+        for fix in fixes:
+            if fix.order_id in states:
+                by_order.setdefault(fix.order_id, []).append(fix)
+        cold = [order_id for order_id in by_order if states[order_id] is None]
+        if cold and seed:
+            states.update(_seed_states(cold, {order_id: by_order[order_id] for order_id in cold}))
+        for order_id in cold:
+            if states[order_id] is None:
+                states[order_id] = new_state()
+        _apply_fixes(states, by_order)
+        cache.set_many(
+            {_key(order_id): states[order_id] for order_id in by_order},
+            _setting('ETA_STATE_TTL', 3600),
+        )
+
+    _set_progress(orders, states)
+
+
+def _seed_states(order_ids, batch_fixes):
+    """Build state for orders seen for the first time from their recent history"""
+    window = timedelta(seconds=_setting('ETA_WINDOW_SECONDS', 300))
+    earliest = {order_id: min(fix.timestamp for fix in fixes) for order_id, fixes in batch_fixes.items()}
+    rows = (
+        LocationUpdate.objects
+        .filter(order_id__in=order_ids, timestamp__gte=min(earliest.values()) - window)
+        .order_by('order_id', 'timestamp', 'id')
+        .values_list('order_id', 'latitude', 'longitude', 'timestamp')
+    )
+    # Rows written for the current batch are folded in by the caller
+    history = {}
+    for order_id, lat, lng, ts in rows:
+        if ts < earliest[order_id]:
+            history.setdefault(order_id, []).append((ts.timestamp(), float(lat), float(lng)))
+
+    states = {order_id: new_state() for order_id in order_ids}
+    points = [(order_id, point) for order_id, fixes in history.items() for point in fixes]
+    if points:
+        # Segment lengths of every seeded order in one call; a zero-length
+        # segment starts each order's history
+        previous = [
+            points[i - 1][1] if i and points[i - 1][0] == order_id else point
+            for i, (order_id, point) in enumerate(points)
+        ]
+        segments = haversine_m(
+            [p[1] for p in previous], [p[2] for p in previous],
+            [p[1] for _, p in points], [p[2] for _, p in points],
+        )
+        for (order_id, (ts, lat, lng)), segment in zip(points, segments):
+            advance(states[order_id], ts, lat, lng, segment)
+    return states
+
+
+def _apply_fixes(states, by_order):
+    steps = []
+    for order_id, fixes in by_order.items():
+        state = states[order_id]
+        last_ts, last_lat, last_lng = state['ts'], state['lat'], state['lng']
+        for fix in sorted(fixes, key=lambda fix: fix.timestamp):
+            ts = fix.timestamp.timestamp()
+            if last_ts is not None and ts <= last_ts:
+                continue  # Late or repeated fix
+            if last_ts is None:
+                last_lat, last_lng = fix.latitude, fix.longitude
+            steps.append((order_id, ts, last_lat, last_lng, fix.latitude, fix.longitude))
+            last_ts, last_lat, last_lng = ts, fix.latitude, fix.longitude
+
+    if not steps:
+        return
+    segments = haversine_m(
+        [step[2] for step in steps], [step[3] for step in steps],
+        [step[4] for step in steps], [step[5] for step in steps],
+    )
+    for (order_id, ts, _, _, lat, lng), segment in zip(steps, segments):
+        advance(states[order_id], ts, lat, lng, segment)
+
+
+def _set_progress(orders, states):
+    travelling = [
+        order for order in orders
+        if order.status == 'dispatched'
+        and order.current_latitude is not None and order.current_longitude is not None
+        and order.delivery_latitude is not None and order.delivery_longitude is not None
+    ]
+    for order in orders:
+        order.progress = None
+    if not travelling:
+        return
+
+    remaining = haversine_m(
+        [float(order.current_latitude) for order in travelling],
+        [float(order.current_longitude) for order in travelling],
+        [float(order.delivery_latitude) for order in travelling],
+        [float(order.delivery_longitude) for order in travelling],
+    )
+    for order, remaining_m in zip(travelling, remaining):
+        state = states.get(order.id)
+        average = speed(state)
+        eta_seconds = None
+        eta = None
+        if average is not None and average >= MIN_SPEED:
+            eta_seconds = round(remaining_m / average)
+            eta = (datetime.fromtimestamp(state['ts'], tz=dt_timezone.utc) + timedelta(seconds=eta_seconds)).isoformat()
+        order.progress = {
+            'remaining_km': round(remaining_m / 1000, 3),
+            'speed_kmh': round(average * 3.6, 1) if average is not None else None,
+            'eta_seconds': eta_seconds,
+            'eta': eta,
+        }
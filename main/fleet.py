@@ -0,0 +1,150 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.http import quote_etag
+
+from .models import Order
+from .routing import primary_reads
+from .signals import locations_recorded
+
+# In-process snapshot of every dispatched order's live position, served to the
+# operations map by the fleet_snapshot view.
+#
+# Rows are kept per order and changed as ingestion reports moved orders, and
+# as orders are saved or deleted; code paths that use queryset.update() call
+# fleet.discard(). Every FLEET_REFRESH_SECONDS the snapshot is reloaded with
+# one query so that fixes ingested by other processes show up too. Each
+# change to a row bumps a version (saves that touch no tracked column don't),
+# and the encoded unfiltered payload and its ETag are
+# kept until the next change, so a map polling every second costs a lookup,
+# or a 304 when it sends back the ETag, and no database work.
+#
+# The payload is columnar: one array per field, rows aligned by index.
+
+COLUMNS = ('order_id', 'latitude', 'longitude', 'status', 'rider_id', 'updated')
+
+
+class FleetSnapshot:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._rows = {}
+        self._version = 0
+        self._loaded_at = None
+        self._encoded = None  # (version, etag, body) of the unfiltered payload
+
+    @staticmethod
+    def _row(order):
+        updated = order.last_location_update
+        return (
+            order.id,
+            round(float(order.current_latitude), 6),
+            round(float(order.current_longitude), 6),
+            order.status,
+            order.assigned_dispatch_id,
+            int(updated.timestamp()) if updated else None,
+        )
+
+    @staticmethod
+    def _tracked(order):
+        return (order.status == 'dispatched'
+                and order.current_latitude is not None and order.current_longitude is not None)
+
+    def refresh(self):
+        orders = (
+            Order.objects
+            .filter(status='dispatched', current_latitude__isnull=False, current_longitude__isnull=False)
+            .only('id', 'status', 'current_latitude', 'current_longitude', 'last_location_update', 'assigned_dispatch')
+        )
+        # Kept for FLEET_REFRESH_SECONDS, so never from a lagging replica
+        with primary_reads():
+            rows = {order.id: self._row(order) for order in orders.iterator()}
+        with self._lock:
+            if rows != self._rows:
+                self._rows = rows
+                self._version += 1
+            self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        refresh_seconds = getattr(settings, 'FLEET_REFRESH_SECONDS', 30)
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < refresh_seconds:
+            return
+        with self._refresh_lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= refresh_seconds:
+                self.refresh()
+
+    def sync(self, orders):
+        """Add, move or drop each order depending on whether it is out for delivery"""
+        if self._loaded_at is None:
+            return  # Nothing loaded yet; the first request loads from the DB
+        with self._lock:
+            changed = False
+            for order in orders:
+                if self._tracked(order):
+                    row = self._row(order)
+                    if self._rows.get(order.id) != row:
+                        self._rows[order.id] = row
+                        changed = True
+                elif self._rows.pop(order.id, None) is not None:
+                    changed = True
+            if changed:
+                self._version += 1
+
+    def discard(self, order_id):
+        with self._lock:
+            if self._rows.pop(order_id, None) is not None:
+                self._version += 1
+
+    def payload(self, bbox=None):
+        """
+        (etag, encoded JSON body) for the current snapshot, limited to
+        orders inside bbox = (min_lng, min_lat, max_lng, max_lat) if given.
+        """
+        self._ensure_fresh()
+        with self._lock:
+            version = self._version
+            if bbox is None and self._encoded is not None and self._encoded[0] == version:
+                return self._encoded[1:]
+            rows = list(self._rows.values())
+
+        if bbox is not None:
+            min_lng, min_lat, max_lng, max_lat = bbox
+            rows = [row for row in rows if min_lat <= row[1] <= max_lat and min_lng <= row[2] <= max_lng]
+        rows.sort()
+        columns = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+        body = json.dumps({
+            'success': True,
+            'count': len(rows),
+            'orders': {name: list(values) for name, values in zip(COLUMNS, columns)},
+        }, separators=(',', ':')).encode()
+        etag = quote_etag(hashlib.blake2b(body, digest_size=12).hexdigest())
+
+        if bbox is None:
+            with self._lock:
+                if self._version == version:
+                    self._encoded = (version, etag, body)
+        return etag, body
+
+
+fleet = FleetSnapshot()
+
+
+@receiver(locations_recorded, sender=Order)
+def sync_moved_orders(sender, orders, **kwargs):
+    fleet.sync(orders)
+
+
+@receiver(post_save, sender=Order)
+def sync_saved_order(sender, instance, **kwargs):
+    fleet.sync([instance])
+
+
+@receiver(post_delete, sender=Order)
+def drop_deleted_order(sender, instance, **kwargs):
+    fleet.discard(instance.id)
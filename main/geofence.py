@@ -0,0 +1,173 @@
+import logging
+import math
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from .models import Order
+from .rider_stats import record_delivered
+from .signals import geofence_crossed
+
+logger = logging.getLogger(__name__)
+
+# Arrival and departure detection at pickup and delivery points.
+#
+# Every order being delivered gets two circular fences, one around its pickup
+# and one around its drop-off. A fence is precomputed once per process from
+# the order's coordinates: its centre, the metres-per-degree scale at that
+# latitude and the squared entry and exit radii. Checking a fix is then a
+# handful of multiplications on a flat-earth approximation, which is exact
+# enough at fence scale, so the stage is O(1) per fix.
+#
+# The exit radius is GEOFENCE_EXIT_FACTOR times the entry radius, so a rider
+# hovering at the edge does not flap between arrival and departure. Which
+# fences an order is inside, and since when, lives in the snapshot cache
+# (one get_many and at most one set_many per request), and the orders come
+# from ingestion's own query, so the stage adds no per-fix database work.
+#
+# That state must be seen by every worker, or a rider's fixes landing on
+# different processes would fire arrivals twice and never reach the dwell
+# time, so ORDER_SNAPSHOT_CACHE has to be a shared cache (check main.W001).
+# Only the fence geometry is kept per process, in _fences: it is derived
+# from the order's coordinates alone and rebuilt whenever they change.
+#
+# Events are sent on the geofence_crossed signal. With GEOFENCE_AUTO_DELIVER
+# set, a rider who stays inside the delivery fence for GEOFENCE_DWELL_SECONDS
+# completes the order, exactly as the complete_delivery view would; that
+# guarded UPDATE is the only query the stage ever makes, and only on events.
+
+METRES_PER_DEGREE = 111320.0
+
+FENCES = ('pickup', 'delivery')
+
+Fence = namedtuple('Fence', ['name', 'latitude', 'longitude', 'scale', 'entry_sq', 'exit_sq'])
+
+GeofenceEvent = namedtuple('GeofenceEvent', ['order_id', 'fence', 'kind', 'timestamp', 'latitude', 'longitude'])
+
+# order_id -> (coordinates the fences were built from, fences); at most
+# GEOFENCE_MAX_ORDERS entries before it is cleared
+_fences = {}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _cache():
+    return caches[_setting('ORDER_SNAPSHOT_CACHE', 'default')]
+
+
+def _key(order_id):
+    return f'order-geofence:{order_id}'
+
+
+def build_fence(name, latitude, longitude, radius_m):
+    exit_m = radius_m * _setting('GEOFENCE_EXIT_FACTOR', 1.5)
+    return Fence(
+        name, latitude, longitude,
+        math.cos(math.radians(latitude)),
+        (radius_m / METRES_PER_DEGREE) ** 2,
+        (exit_m / METRES_PER_DEGREE) ** 2,
+    )
+
+
+def fences_for(order):
+    """The order's fences, built on first use and whenever its points move"""
+    points = (order.pickup_latitude, order.pickup_longitude, order.delivery_latitude, order.delivery_longitude)
+    cached = _fences.get(order.id)
+    if cached is not None and cached[0] == points:
+        return cached[1]
+
+    fences = []
+    radii = {
+        'pickup': _setting('GEOFENCE_PICKUP_RADIUS_M', 75),
+        'delivery': _setting('GEOFENCE_DELIVERY_RADIUS_M', 50),
+    }
+    for name, latitude, longitude in (('pickup', *points[:2]), ('delivery', *points[2:])):
+        if latitude is not None and longitude is not None:
+            fences.append(build_fence(name, float(latitude), float(longitude), radii[name]))
+
+    if len(_fences) >= _setting('GEOFENCE_MAX_ORDERS', 10000):
+        _fences.clear()
+    _fences[order.id] = (points, fences)
+    return fences
+
+
+def distance_sq(fence, latitude, longitude):
+    """Squared distance from the fence centre, in degrees of latitude"""
+    dlat = latitude - fence.latitude
+    dlng = (longitude - fence.longitude) * fence.scale
+    return dlat * dlat + dlng * dlng
+
+
+def detect(orders, fixes):
+    """
+    Run the orders' fixes through their fences.
+
+    orders maps order id to Order, as loaded by ingestion; fixes are in the
+    order the device produced them. Sends geofence_crossed with any events,
+    applies automatic deliveries, and returns the orders whose status changed.
+    """
+    watched = {}
+    for fix in fixes:
+        order = orders.get(fix.order_id)
+        if order is not None and order.status == 'dispatched' and fences_for(order):
+            watched.setdefault(fix.order_id, []).append(fix)
+    if not watched:
+        return []
+
+    cache = _cache()
+    stored = cache.get_many([_key(order_id) for order_id in watched])
+    events = []
+    changed = {}
+    delivered = []
+    dwell = _setting('GEOFENCE_DWELL_SECONDS', 30)
+    auto_deliver = _setting('GEOFENCE_AUTO_DELIVER', False)
+
+    for order_id, order_fixes in watched.items():
+        state = stored.get(_key(order_id)) or {'ts': None, 'inside': {}}
+        order = orders[order_id]
+        fences = fences_for(order)
+        for fix in order_fixes:
+            ts = fix.timestamp.timestamp()
+            if state['ts'] is not None and ts <= state['ts']:
+                continue  # Late or repeated fix
+            state['ts'] = ts
+            for fence in fences:
+                since = state['inside'].get(fence.name)
+                d_sq = distance_sq(fence, fix.latitude, fix.longitude)
+                if since is None and d_sq <= fence.entry_sq:
+                    state['inside'][fence.name] = since = ts
+                    events.append(GeofenceEvent(order_id, fence.name, 'arrival', fix.timestamp, fix.latitude, fix.longitude))
+                elif since is not None and d_sq > fence.exit_sq:
+                    del state['inside'][fence.name]
+                    since = None
+                    events.append(GeofenceEvent(order_id, fence.name, 'departure', fix.timestamp, fix.latitude, fix.longitude))
+                if (auto_deliver and fence.name == 'delivery' and since is not None
+                        and ts - since >= dwell and order not in delivered):
+                    delivered.append(order)
+        changed[_key(order_id)] = state
+
+    cache.set_many(changed, _setting('GEOFENCE_STATE_TTL', 3600))
+    if events:
+        for event in events:
+            logger.info('Geofence %s at %s for order %s', event.kind, event.fence, event.order_id)
+        geofence_crossed.send(sender=Order, events=events)
+    return [order for order in delivered if _complete(order)]
+
+
+def _complete(order):
+    """Mark an order delivered unless someone else got there first"""
+    # Same guarded UPDATE as complete_delivery, so a button press and an
+    # automatic delivery count the order once between them
+    delivered_at = timezone.now()
+    if not Order.objects.filter(id=order.id, status='dispatched').update(status='delivered', delivered_at=delivered_at):
+        return False
+    order.status = 'delivered'
+    order.delivered_at = delivered_at
+    if order.assigned_dispatch_id:
+        record_delivered(order.assigned_dispatch_id)
+    logger.info('Order %s delivered automatically on arrival', order.id)
+    return True
@@ -0,0 +1,256 @@
+from collections import namedtuple
+from contextlib import nullcontext
+from datetime import timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Case, When, Value
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .eta import attach_progress
+from .geofence import detect as detect_geofences
+from .models import Order, LocationUpdate, UserProfile
+from .reporting import ingest_rate, report_interval
+from .signals import locations_recorded
+from .write_behind import location_buffer
+
+# Location ingestion shared by update_location and the batch endpoint.
+# Every accepted fix ends up as one LocationUpdate row, and every order
+# touched by a request has its current_* fields moved to its newest fix.
+
+# device and seq identify a fix across retried uploads; a repeated
+# (device, seq) pair is not written again
+Fix = namedtuple('Fix', ['order_id', 'latitude', 'longitude', 'timestamp', 'notes', 'device', 'seq'],
+                 defaults=(None, None))
+
+MAX_DEVICE_LENGTH = 64
+
+# Largest value a BIGINT column (and the database's integer parameters) holds
+MAX_BIGINT = 2 ** 63 - 1
+
+
+def parse_fix(data, order_id=None, device=None):
+    """
+    Build a Fix from a decoded JSON object, raising ValueError if it is
+    unusable. device is used when the object does not name its own.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Invalid fix')
+
+    if order_id is None:
+        order_id = data.get('order_id')
+    try:
+        order_id = int(order_id)
+    except (TypeError, ValueError):
+        raise ValueError('Missing order_id')
+    if not 0 < order_id <= MAX_BIGINT:
+        raise ValueError('Invalid order_id')
+
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
+    if latitude in (None, '') or longitude in (None, ''):
+        raise ValueError('Missing coordinates')
+    try:
+        latitude = float(latitude)
+        longitude = float(longitude)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid coordinates')
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('Invalid coordinates')
+
+    now = timezone.now()
+    timestamp = data.get('timestamp')
+    if timestamp:
+        timestamp = parse_datetime(str(timestamp))
+        if timestamp is None:
+            raise ValueError('Invalid timestamp')
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp, dt_timezone.utc)
+        # Never let a device clock push history into the future
+        timestamp = min(timestamp, now)
+    else:
+        timestamp = now
+
+    device, seq = parse_sequence(data.get('device', device), data.get('seq'))
+    return Fix(order_id, latitude, longitude, timestamp, data.get('notes', '') or '', device, seq)
+
+
+def parse_sequence(device, seq):
+    """Validated (device, seq), or (None, None) when the fix is not sequenced"""
+    if device in (None, '') or seq in (None, ''):
+        return None, None
+    if not isinstance(device, str) or len(device) > MAX_DEVICE_LENGTH:
+        raise ValueError('Invalid device')
+    try:
+        seq = int(seq)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid seq')
+    if not 0 <= seq <= MAX_BIGINT:
+        raise ValueError('Invalid seq')
+    return device, seq
+
+
+def ingest_fixes(fixes, rider_id=None):
+    """
+    Record a list of fixes, in the order the device produced them. With
+    rider_id, fixes for orders not assigned to that rider are refused as if
+    the order did not exist.
+
+    Runs at most four queries no matter how many fixes or orders are
+    involved: one to load the orders, one bulk insert into the history table,
+    one update moving each order to its newest fix and one moving the riders
+    of those orders. With write-behind enabled only the first runs here and
+    the writes are left to the location buffer. The geofence stage only
+    queries when it delivers an order. Returns one result dict per fix, in
+    input order; accepted fixes carry the device's next report interval.
+    """
+    orders = Order.objects.all()
+    if rider_id is not None:
+        orders = orders.filter(assigned_dispatch_id=rider_id)
+    orders = orders.in_bulk({fix.order_id for fix in fixes})
+
+    results = []
+    accepted = []
+    for fix in fixes:
+        if fix.order_id not in orders:
+            results.append({'success': False, 'order_id': fix.order_id, 'error': 'Order not found'})
+            continue
+        accepted.append(fix)
+        results.append({'success': True, 'order_id': fix.order_id, 'timestamp': fix.timestamp.isoformat()})
+
+    if accepted:
+        buffered = location_buffer.enabled
+        # All or nothing: a request that fails part way leaves no history
+        # behind, so the device's retry does not write its fixes twice. The
+        # buffer is only filled once nothing else can fail.
+        with nullcontext() if buffered else transaction.atomic():
+            if buffered:
+                for order in orders.values():
+                    apply_buffered_position(order)
+                moved = _move_orders(orders, accepted)
+                # History in the DB lags behind the buffer, so don't seed from it
+                attach_progress(moved, accepted, seed=False)
+            else:
+                moved = write_fixes(accepted, orders)
+                attach_progress(moved, accepted)
+            # Orders the geofence stage delivered get their new status published too
+            moved += [order for order in detect_geofences(orders, accepted) if order not in moved]
+        if buffered:
+            location_buffer.add(accepted)
+        locations_recorded.send(sender=Order, orders=moved, fixes=accepted)
+
+        # Tell each device when to report next
+        ingest_rate.observe(len(accepted))
+        intervals = {}
+        for result in results:
+            if result['success']:
+                order_id = result['order_id']
+                if order_id not in intervals:
+                    intervals[order_id] = report_interval(orders[order_id])
+                result['next_report_seconds'] = intervals[order_id]
+
+    return results
+
+
+async def aingest_fixes(fixes, rider_id=None):
+    """
+    ingest_fixes for async views. The whole write runs in one hop to the
+    ORM's thread rather than one per query.
+    """
+    return await sync_to_async(ingest_fixes)(fixes, rider_id)
+
+
+def write_fixes(fixes, orders):
+    """
+    Write fixes for already-loaded orders; returns the orders whose position
+    moved. Callers run it in a transaction so a failure writes nothing.
+    """
+    LocationUpdate.objects.bulk_create((
+        LocationUpdate(
+            order_id=fix.order_id,
+            latitude=fix.latitude,
+            longitude=fix.longitude,
+            timestamp=fix.timestamp,
+            notes=fix.notes,
+            device=fix.device,
+            seq=fix.seq,
+        )
+        for fix in fixes
+    ), ignore_conflicts=True)  # Replayed (device, seq) fixes are already stored
+    moved = _move_orders(orders, fixes)
+    _save_positions(moved)
+    _advance_riders(moved)
+    return moved
+
+
+def apply_buffered_position(order):
+    """Show the newest position still waiting in the write-behind buffer, if any"""
+    fix = location_buffer.latest(order.id)
+    if fix is not None and (order.last_location_update is None or fix.timestamp > order.last_location_update):
+        order.current_latitude = fix.latitude
+        order.current_longitude = fix.longitude
+        order.last_location_update = fix.timestamp
+    return order
+
+
+def _move_orders(orders, fixes):
+    """Point each order at its newest fix in memory; returns the orders that moved"""
+    latest = {}
+    for fix in fixes:
+        newest = latest.get(fix.order_id)
+        if newest is None or fix.timestamp >= newest.timestamp:
+            latest[fix.order_id] = fix
+
+    moved = []
+    for order_id, fix in latest.items():
+        order = orders[order_id]
+        # Skip fixes older than what the order already shows (late retries)
+        if order.last_location_update and order.last_location_update > fix.timestamp:
+            continue
+        order.current_latitude = fix.latitude
+        order.current_longitude = fix.longitude
+        order.last_location_update = fix.timestamp
+        moved.append(order)
+    return moved
+
+
+def _save_positions(moved):
+    """Write the moved orders' positions in a single UPDATE"""
+    if len(moved) == 1:
+        order = moved[0]
+        Order.objects.filter(pk=order.pk).update(
+            current_latitude=order.current_latitude,
+            current_longitude=order.current_longitude,
+            last_location_update=order.last_location_update,
+        )
+    elif moved:
+        Order.objects.bulk_update(moved, ['current_latitude', 'current_longitude', 'last_location_update'])
+
+
+def _advance_riders(moved):
+    """Copy each moved order's position onto its rider's profile in a single UPDATE"""
+    riders = {order.assigned_dispatch_id: order for order in moved if order.assigned_dispatch_id}
+    if not riders:
+        return
+
+    if len(riders) == 1:
+        (user_id, order), = riders.items()
+        UserProfile.objects.filter(user_id=user_id).update(
+            last_latitude=order.current_latitude,
+            last_longitude=order.current_longitude,
+            last_location_update=order.last_location_update,
+        )
+        return
+
+    def by_rider(attr, field):
+        return Case(
+            *[When(user_id=user_id, then=Value(getattr(order, attr))) for user_id, order in riders.items()],
+            output_field=UserProfile._meta.get_field(field),
+        )
+
+    UserProfile.objects.filter(user_id__in=riders).update(
+        last_latitude=by_rider('current_latitude', 'last_latitude'),
+        last_longitude=by_rider('current_longitude', 'last_longitude'),
+        last_location_update=by_rider('last_location_update', 'last_location_update'),
+    )
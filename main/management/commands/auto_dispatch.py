@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from main.dispatcher import dispatch_setting, dispatch_tick
+
+
+class Command(BaseCommand):
+    help = (
+        'Assign pending orders to the nearest available riders in batches. '
+        'Runs one tick by default, or keeps running with --loop.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running, one tick every --interval seconds')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Seconds between ticks (default: AUTO_DISPATCH_INTERVAL)')
+        parser.add_argument('--budget-ms', type=float, default=None,
+                            help='Time budget per tick (default: AUTO_DISPATCH_BUDGET_MS)')
+        parser.add_argument('--max-distance', type=float, default=None,
+                            help='Furthest rider, in km, considered for an order '
+                                 '(default: AUTO_DISPATCH_MAX_DISTANCE_KM)')
+        parser.add_argument('--dry-run', action='store_true', help='Compute the matching without assigning')
+
+    def handle(self, *args, **options):
+        interval = options['interval'] if options['interval'] is not None else dispatch_setting('INTERVAL', 10)
+        if interval <= 0:
+            raise CommandError('--interval must be positive')
+
+        while True:
+            started = time.monotonic()
+            result = dispatch_tick(options['budget_ms'], options['max_distance'], options['dry_run'])
+            self.stdout.write(
+                f"{'Matched' if options['dry_run'] else 'Assigned'} "
+                f"{result['matched'] if options['dry_run'] else result['assigned']} of {result['orders']} orders "
+                f"to {result['riders']} riders in {result['ms']} ms "
+                f"({result['considered']} considered, {result['conflicts']} lost to manual accepts)"
+            )
+            if not options['loop']:
+                return
+            close_old_connections()
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
@@ -0,0 +1,102 @@
+import threading
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from main.assignment import claim_order
+from main.benchmarking import percentile
+from main.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        'Contention benchmark for order acceptance: N rider threads race to '
+        'accept each order at the same moment. Fails unless every order has '
+        'exactly one winner. Creates its own users and orders and removes them '
+        'afterwards, so point it at a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--riders', type=int, default=16, help='Concurrent riders (threads)')
+        parser.add_argument('--orders', type=int, default=50, help='Orders to race for')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated users and orders')
+
+    def handle(self, *args, **options):
+        riders_count = options['riders']
+        orders_count = options['orders']
+        if riders_count < 1 or orders_count < 1:
+            raise CommandError('--riders and --orders must be at least 1')
+
+        tag = uuid.uuid4().hex[:8]
+        customer = User.objects.create(username=f'bench-{tag}-customer')
+        riders = User.objects.bulk_create(
+            User(username=f'bench-{tag}-rider-{i}') for i in range(riders_count)
+        )
+        orders = Order.objects.bulk_create(
+            Order(user=customer, name=f'bench-{tag}-{i}', description='Acceptance benchmark')
+            for i in range(orders_count)
+        )
+        order_ids = [order.id for order in orders]
+
+        wins = {order_id: [] for order_id in order_ids}
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(riders_count)
+
+        def race(rider):
+            try:
+                for order_id in order_ids:
+                    # Line every rider up so they all hit the same order together
+                    barrier.wait()
+                    started = time.perf_counter()
+                    won = claim_order(order_id, rider)
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+                        if won:
+                            wins[order_id].append(rider.id)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                barrier.abort()
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=race, args=(rider,)) for rider in riders]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        try:
+            if errors:
+                raise CommandError(f'Benchmark aborted: {errors[0]!r}')
+
+            assigned = dict(Order.objects.filter(id__in=order_ids).values_list('id', 'assigned_dispatch_id'))
+            bad = [
+                order_id for order_id, winners in wins.items()
+                if len(winners) != 1 or assigned[order_id] != winners[0]
+            ]
+            if bad:
+                raise CommandError(f'{len(bad)} of {orders_count} orders did not have exactly one winner')
+
+            attempts = len(latencies)
+            latencies.sort()
+            self.stdout.write(f'database:      {connection.vendor}')
+            self.stdout.write(f'riders:        {riders_count}')
+            self.stdout.write(f'orders:        {orders_count} (one winner each)')
+            self.stdout.write(f'attempts:      {attempts} in {wall:.3f}s')
+            self.stdout.write(f'throughput:    {attempts / wall:.0f} accepts/s, {orders_count / wall:.0f} orders/s')
+            self.stdout.write(f'latency p50:   {percentile(latencies, 0.50) * 1000:.2f} ms')
+            self.stdout.write(f'latency p95:   {percentile(latencies, 0.95) * 1000:.2f} ms')
+            self.stdout.write(self.style.SUCCESS('OK'))
+        finally:
+            if not options['keep']:
+                Order.objects.filter(id__in=order_ids).delete()
+                User.objects.filter(username__startswith=f'bench-{tag}-').delete()
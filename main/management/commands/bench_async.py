@@ -0,0 +1,141 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.urls import reverse
+
+from main.benchmarking import Fixture, Recorder, write_report
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the tracking APIs served through the WSGI handler by a fixed '
+        'pool of threads (one in-flight request per thread, as a threaded WSGI '
+        'server would) with the ASGI handler on one event loop, at the same '
+        'number of concurrent clients. Runs in-process, so it measures the '
+        'Django side only. Creates its own data and removes it afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=100, help='Concurrent clients')
+        parser.add_argument('--requests', type=int, default=20, help='Requests per client')
+        parser.add_argument('--threads', type=int, default=8, help='WSGI worker threads')
+        parser.add_argument('--endpoint', choices=['poll', 'update'], default='poll',
+                            help='get_order_location polls or update_location posts')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        if concurrency < 1 or options['requests'] < 1 or options['threads'] < 1:
+            raise CommandError('--concurrency, --requests and --threads must be positive')
+
+        fixture = Fixture(customers=concurrency, riders=1)
+        try:
+            jobs = self.jobs(fixture, options)
+            report = {}
+            wsgi = self.run_wsgi(jobs, options)
+            report.update(wsgi.pop('endpoints'))
+            asgi = self.run_asgi(jobs, options)
+            report.update(asgi.pop('endpoints'))
+        finally:
+            fixture.delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps({'wsgi': wsgi, 'asgi': asgi, 'endpoints': report}, indent=2))
+            return
+        self.stdout.write(f"clients: {concurrency}, WSGI threads: {options['threads']}")
+        write_report(self.stdout, report)
+        for name, run in (('wsgi', wsgi), ('asgi', asgi)):
+            self.stdout.write(
+                f"{name}: {run['requests']} requests in {run['seconds']:.2f}s "
+                f"({run['throughput']:.0f} req/s), peak threads {run['peak_threads']}"
+            )
+
+    def jobs(self, fixture, options):
+        """One (user, method, path, body) per client"""
+        jobs = []
+        for customer, order in zip(fixture.customers, fixture.orders):
+            if options['endpoint'] == 'poll':
+                jobs.append((customer, 'get', reverse('get_order_location', args=[order.id]), None))
+            else:
+                body = json.dumps({'latitude': 6.55, 'longitude': 3.37})
+                jobs.append((fixture.riders[0], 'post', reverse('update_location', args=[order.id]), body))
+        return jobs
+
+    def run_wsgi(self, jobs, options):
+        recorder = Recorder()
+        label = f"wsgi {options['endpoint']}"
+        peak = [threading.active_count()]
+
+        def client_for(user):
+            client = Client()
+            client.force_login(user)
+            return client
+
+        clients = [client_for(user) for user, _, _, _ in jobs]
+
+        def call(client, method, path, body):
+            started = time.perf_counter()
+            if body is None:
+                response = getattr(client, method)(path)
+            else:
+                response = getattr(client, method)(path, data=body, content_type='application/json')
+            recorder.add(label, time.perf_counter() - started, status=response.status_code)
+            peak[0] = max(peak[0], threading.active_count())
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            futures = [
+                pool.submit(call, client, method, path, body)
+                for _ in range(options['requests'])
+                for client, (_, method, path, body) in zip(clients, jobs)
+            ]
+            for future in futures:
+                future.result()
+            # Close the workers' connections before the pool goes away
+            list(pool.map(lambda _: connections.close_all(), range(options['threads'])))
+        wall = time.perf_counter() - started
+        return self.summary(recorder, wall, peak[0])
+
+    def run_asgi(self, jobs, options):
+        recorder = Recorder()
+        label = f"asgi {options['endpoint']}"
+        peak = [threading.active_count()]
+
+        async def client_loop(user, method, path, body):
+            client = AsyncClient()
+            await sync_to_async(client.force_login)(user)
+            for _ in range(options['requests']):
+                started = time.perf_counter()
+                if body is None:
+                    response = await getattr(client, method)(path)
+                else:
+                    response = await getattr(client, method)(path, data=body, content_type='application/json')
+                recorder.add(label, time.perf_counter() - started, status=response.status_code)
+                peak[0] = max(peak[0], threading.active_count())
+
+        async def run_all():
+            await asyncio.gather(*(client_loop(*job) for job in jobs))
+
+        started = time.perf_counter()
+        asyncio.run(run_all())
+        wall = time.perf_counter() - started
+        return self.summary(recorder, wall, peak[0])
+
+    @staticmethod
+    def summary(recorder, wall, peak_threads):
+        endpoints = recorder.summary(wall)
+        requests = sum(row['requests'] for row in endpoints.values())
+        return {
+            'requests': requests,
+            'seconds': round(wall, 3),
+            'throughput': round(requests / wall, 1) if wall else 0.0,
+            'peak_threads': peak_threads,
+            'endpoints': endpoints,
+        }
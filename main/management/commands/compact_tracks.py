@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+
+from main.compaction import compact_order, default_tolerance
+from main.models import Order, LocationUpdate
+
+
+class Command(BaseCommand):
+    help = (
+        'Simplify the location history of delivered orders into one encoded '
+        'track per order and delete the raw LocationUpdate rows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tolerance', type=float, default=None,
+            help='Maximum deviation in metres from the raw track (default: TRACK_SIMPLIFY_TOLERANCE_M)',
+        )
+        parser.add_argument('--limit', type=int, default=None, help='Compact at most this many orders')
+
+    def handle(self, *args, **options):
+        tolerance = options['tolerance'] if options['tolerance'] is not None else default_tolerance()
+        orders = (
+            Order.objects
+            .filter(status='delivered')
+            .filter(Exists(LocationUpdate.objects.filter(order=OuterRef('pk'))))
+            .order_by('id')
+        )
+        if options['limit']:
+            orders = orders[:options['limit']]
+
+        compacted = 0
+        raw_points = 0
+        kept_points = 0
+        for order in orders.iterator():
+            track = compact_order(order, tolerance)
+            if track is None:
+                continue
+            compacted += 1
+            raw_points += track.raw_point_count
+            kept_points += track.point_count
+
+        if not compacted:
+            self.stdout.write('Nothing to compact.')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Compacted {compacted} orders: {raw_points} fixes -> {kept_points} points '
+            f'({raw_points / max(kept_points, 1):.1f}x) at {tolerance} m tolerance'
+        ))
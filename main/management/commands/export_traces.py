@@ -0,0 +1,40 @@
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from main.traces import export_traces, exportable_orders
+
+
+class Command(BaseCommand):
+    help = (
+        'Export raw rider traces from LocationUpdate to a compact gzipped '
+        'trace file that replay_traces can play back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Trace file to write, e.g. traces.jsonl.gz')
+        parser.add_argument('--order', type=int, action='append', dest='orders',
+                            help='Export only this order (repeatable)')
+        parser.add_argument('--days', type=int, default=None,
+                            help='Only orders that moved in the last N days')
+        parser.add_argument('--limit', type=int, default=None, help='Export at most this many orders')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['days'] is not None:
+            if options['days'] < 1:
+                raise CommandError('--days must be at least 1')
+            since = timezone.now() - timedelta(days=options['days'])
+
+        orders = exportable_orders(options['orders'], since, options['limit'])
+        traces, fixes = export_traces(options['output'], orders)
+        if not traces:
+            self.stdout.write('No orders with at least two fixes to export.')
+            return
+        size = os.path.getsize(options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {traces} traces ({fixes} fixes) to {options["output"]}: '
+            f'{size} bytes, {size / fixes:.1f} bytes per fix'
+        ))
@@ -0,0 +1,133 @@
+import json
+import math
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from main.benchmarking import Fixture, Recorder, write_report
+from main.write_behind import location_buffer
+
+
+class Command(BaseCommand):
+    help = (
+        'In-process load test: seeds customers, riders and dispatched orders, then '
+        'runs rider threads posting fixes and customer threads polling locations '
+        'and dashboards. Reports p50/p95/p99 latency, throughput and queries per '
+        'request for each endpoint. Creates its own data and removes it '
+        'afterwards, so point it at a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--riders', type=int, default=10, help='Rider threads posting fixes')
+        parser.add_argument('--watchers', type=int, default=40, help='Customer threads polling')
+        parser.add_argument('--iterations', type=int, default=50, help='Requests per thread')
+        parser.add_argument('--dashboard-every', type=int, default=10,
+                            help='Load a dashboard every N requests per thread (0 to skip)')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated data')
+
+    def handle(self, *args, **options):
+        riders = options['riders']
+        watchers = options['watchers']
+        if riders < 1 or watchers < 0:
+            raise CommandError('Need at least one rider and zero or more watchers')
+
+        fixture = Fixture(customers=max(watchers, riders), riders=riders)
+        recorder = Recorder()
+        errors = []
+        barrier = threading.Barrier(riders + watchers)
+        iterations = options['iterations']
+        dashboard_every = options['dashboard_every']
+
+        def timed(client, endpoint, method, path, **kwargs):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = getattr(client, method)(path, **kwargs)
+                elapsed = time.perf_counter() - started
+            recorder.add(endpoint, elapsed, len(queries), response.status_code)
+
+        def rider_loop(rider):
+            client = Client()
+            client.force_login(rider)
+            orders = fixture.orders_for_rider(rider)
+            barrier.wait()
+            for i in range(iterations):
+                order = orders[i % len(orders)]
+                # Drive round a small circle so consecutive fixes differ
+                angle = i / 10
+                body = json.dumps({
+                    'latitude': 6.55 + 0.01 * math.sin(angle),
+                    'longitude': 3.37 + 0.01 * math.cos(angle),
+                })
+                timed(client, 'update_location', 'post',
+                      reverse('update_location', args=[order.id]),
+                      data=body, content_type='application/json')
+                if dashboard_every and i % dashboard_every == dashboard_every - 1:
+                    timed(client, 'dispatch_dashboard', 'get', reverse('dispatch_dashboard'))
+
+        def watcher_loop(customer):
+            client = Client()
+            client.force_login(customer)
+            orders = fixture.orders_for_customer(customer)
+            barrier.wait()
+            for i in range(iterations):
+                order = orders[i % len(orders)]
+                timed(client, 'get_order_location', 'get', reverse('get_order_location', args=[order.id]))
+                if dashboard_every and i % dashboard_every == dashboard_every - 1:
+                    timed(client, 'dashboard', 'get', reverse('dashboard'))
+
+        def run(target, user):
+            try:
+                target(user)
+            except Exception as e:
+                errors.append(e)
+                barrier.abort()
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(rider_loop, rider)) for rider in fixture.riders]
+        threads += [
+            threading.Thread(target=run, args=(watcher_loop, customer))
+            for customer in fixture.customers[:watchers]
+        ]
+
+        try:
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall = time.perf_counter() - started
+            if location_buffer.enabled:
+                location_buffer.flush()
+
+            if errors:
+                raise CommandError(f'Load test aborted: {errors[0]!r}')
+
+            report = recorder.summary(wall)
+            total = sum(row['requests'] for row in report.values())
+            if options['json']:
+                self.stdout.write(json.dumps({
+                    'database': connection.vendor,
+                    'riders': riders,
+                    'watchers': watchers,
+                    'seconds': round(wall, 3),
+                    'throughput': round(total / wall, 1),
+                    'endpoints': report,
+                    'write_behind': location_buffer.stats() if location_buffer.enabled else None,
+                }, indent=2))
+                return
+
+            self.stdout.write(f'database: {connection.vendor}, riders: {riders}, watchers: {watchers}')
+            write_report(self.stdout, report)
+            self.stdout.write(f'{total} requests in {wall:.2f}s ({total / wall:.0f} req/s)')
+            if location_buffer.enabled:
+                self.stdout.write(f'write-behind: {location_buffer.stats()}')
+        finally:
+            if not options['keep']:
+                fixture.delete()
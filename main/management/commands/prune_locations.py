@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.retention import (
+    archive_order, default_batch_size, expired_orders, retention_cutoff, retention_statuses,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Apply the location retention policy: roll raw fixes older than '
+        'LOCATION_RETENTION_DAYS for finished orders into their archived track '
+        'and delete the raw rows, in small batches that each commit on their own.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Keep raw fixes newer than this (default: LOCATION_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Rows archived per transaction (default: LOCATION_RETENTION_BATCH_SIZE)')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between batches')
+        parser.add_argument('--limit', type=int, default=None, help='Process at most this many orders')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be archived')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None and options['days'] < 0:
+            raise CommandError('--days must not be negative')
+        batch_size = options['batch_size'] or default_batch_size()
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+
+        cutoff = retention_cutoff(options['days'])
+        orders = expired_orders(cutoff)
+        if options['limit']:
+            orders = orders[:options['limit']]
+
+        if options['dry_run']:
+            count = orders.count()
+            self.stdout.write(
+                f'{count} {"/".join(retention_statuses())} orders have fixes older than {cutoff:%Y-%m-%d %H:%M}.'
+            )
+            return
+
+        processed = archived = deleted = 0
+        for order in orders.iterator():
+            folded, removed = archive_order(order, cutoff, batch_size, pause=options['pause'])
+            processed += 1
+            archived += folded
+            deleted += removed
+
+        if not processed:
+            self.stdout.write('Nothing to archive.')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {archived} fixes from {processed} orders and deleted {deleted} rows '
+            f'(cutoff {cutoff:%Y-%m-%d %H:%M}, batches of {batch_size})'
+        ))
@@ -0,0 +1,192 @@
+import heapq
+import json
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from main.benchmarking import Fixture, Recorder, percentile, write_report
+from main.models import LocationUpdate
+from main.traces import load_traces
+from main.views import MAX_BATCH_FIXES
+from main.write_behind import location_buffer
+
+
+def table_bytes():
+    """On-disk size of the history table, where the database can tell us"""
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_total_relation_size(%s)', [LocationUpdate._meta.db_table])
+        return cursor.fetchone()[0]
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay rider traces written by export_traces against the location '
+        'ingestion endpoints at N times real speed, and report ingest '
+        'throughput, latency, schedule lag and history table growth. Replays '
+        'onto its own throwaway orders and removes them afterwards, so point '
+        'it at a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('traces', help='Trace file from export_traces')
+        parser.add_argument('--speed', type=float, default=10.0, help='Playback speed multiple of real time')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Rider threads; traces are shared out between them')
+        parser.add_argument('--copies', type=int, default=1,
+                            help='Play each trace this many times side by side')
+        parser.add_argument('--align', action='store_true',
+                            help='Start every trace at once instead of keeping their original offsets')
+        parser.add_argument('--batch', action='store_true',
+                            help='Send fixes that fall due together through the batch endpoint')
+        parser.add_argument('--max-seconds', type=float, default=None,
+                            help='Stop scheduling fixes after this much wall time')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated orders and history')
+
+    def handle(self, *args, **options):
+        speed = options['speed']
+        concurrency = options['concurrency']
+        if speed <= 0 or concurrency < 1 or options['copies'] < 1:
+            raise CommandError('--speed, --concurrency and --copies must be positive')
+        try:
+            traces = load_traces(options['traces']) * options['copies']
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot read {options["traces"]}: {e}')
+        if not traces:
+            raise CommandError('The trace file holds no traces')
+
+        concurrency = min(concurrency, len(traces))
+        first_start = min(trace['start'] for trace in traces)
+        max_seconds = options['max_seconds']
+
+        # Trace i is replayed onto fixture order i, whose rider is thread i % concurrency
+        fixture = Fixture(customers=len(traces), riders=concurrency)
+        schedules = [[] for _ in range(concurrency)]
+        for i, (trace, order) in enumerate(zip(traces, fixture.orders)):
+            offset = 0 if options['align'] else trace['start'] - first_start
+            for seconds, lat, lng in trace['fixes']:
+                due = (offset + seconds) / speed
+                if max_seconds is None or due <= max_seconds:
+                    schedules[i % concurrency].append((due, order.id, lat, lng))
+        for schedule in schedules:
+            heapq.heapify(schedule)
+        total_fixes = sum(len(schedule) for schedule in schedules)
+
+        recorder = Recorder()
+        lags = []
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(concurrency + 1)
+
+        def replay(rider, schedule):
+            client = Client()
+            client.force_login(rider)
+            barrier.wait()
+            started = time.perf_counter()
+            while schedule:
+                due = schedule[0][0]
+                wait = started + due - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                now = time.perf_counter() - started
+                ready = [heapq.heappop(schedule)]
+                if options['batch']:
+                    while schedule and schedule[0][0] <= now and len(ready) < MAX_BATCH_FIXES:
+                        ready.append(heapq.heappop(schedule))
+                with lock:
+                    lags.extend(now - item[0] for item in ready)
+
+                if options['batch']:
+                    body = {'fixes': [
+                        {'order_id': order_id, 'latitude': lat, 'longitude': lng}
+                        for _, order_id, lat, lng in ready
+                    ]}
+                    endpoint, path = 'batch_update_location', reverse('batch_update_location')
+                else:
+                    _, order_id, lat, lng = ready[0]
+                    body = {'latitude': lat, 'longitude': lng}
+                    endpoint, path = 'update_location', reverse('update_location', args=[order_id])
+
+                with CaptureQueriesContext(connection) as queries:
+                    sent = time.perf_counter()
+                    response = client.post(path, data=json.dumps(body), content_type='application/json')
+                    elapsed = time.perf_counter() - sent
+                recorder.add(endpoint, elapsed, len(queries), response.status_code)
+
+        def run(rider, schedule):
+            try:
+                replay(rider, schedule)
+            except Exception as e:
+                errors.append(e)
+                barrier.abort()
+            finally:
+                connections.close_all()
+
+        rows_before = LocationUpdate.objects.count()
+        bytes_before = table_bytes()
+        threads = [
+            threading.Thread(target=run, args=(rider, schedule))
+            for rider, schedule in zip(fixture.riders, schedules)
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            try:
+                barrier.wait()
+            except threading.BrokenBarrierError:
+                pass  # A rider thread failed; its error is reported below
+            started = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            wall = time.perf_counter() - started
+            if location_buffer.enabled:
+                location_buffer.flush()
+
+            if errors:
+                raise CommandError(f'Replay aborted: {errors[0]!r}')
+
+            rows_added = LocationUpdate.objects.count() - rows_before
+            bytes_after = table_bytes()
+            lags.sort()
+            report = recorder.summary(wall)
+            summary = {
+                'database': connection.vendor,
+                'traces': len(traces),
+                'concurrency': concurrency,
+                'speed': speed,
+                'fixes': total_fixes,
+                'seconds': round(wall, 3),
+                'fixes_per_second': round(total_fixes / wall, 1) if wall else 0.0,
+                'lag_p50_ms': round(percentile(lags, 0.50) * 1000, 2),
+                'lag_p99_ms': round(percentile(lags, 0.99) * 1000, 2),
+                'rows_added': rows_added,
+                'table_bytes_added': None if bytes_before is None else bytes_after - bytes_before,
+                'endpoints': report,
+            }
+            if options['json']:
+                self.stdout.write(json.dumps(summary, indent=2))
+                return
+
+            self.stdout.write(
+                f'database: {connection.vendor}, traces: {len(traces)}, '
+                f'threads: {concurrency}, speed: {speed}x'
+            )
+            write_report(self.stdout, report)
+            self.stdout.write(
+                f"{total_fixes} fixes in {wall:.2f}s ({summary['fixes_per_second']:.0f} fixes/s), "
+                f"schedule lag p50 {summary['lag_p50_ms']} ms / p99 {summary['lag_p99_ms']} ms"
+            )
+            growth = f'{rows_added} rows'
+            if summary['table_bytes_added'] is not None:
+                growth += f", {summary['table_bytes_added']} bytes"
+            self.stdout.write(f'history table grew by {growth}')
+        finally:
+            if not options['keep']:
+                fixture.delete()
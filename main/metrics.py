@@ -0,0 +1,140 @@
+import bisect
+import contextvars
+import threading
+import time
+
+from django.template.backends.django import DjangoTemplates, Template
+
+# Per-request timing state and in-process latency histograms, filled in by
+# main.middleware.PerformanceMiddleware and read by the metrics view.
+
+# Upper bounds, in milliseconds, of the latency histogram buckets
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+
+class RequestTimings:
+    """Accumulated costs of the request being handled"""
+
+    __slots__ = ('queries', 'db_seconds', 'view_seconds', 'template_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.view_seconds = 0.0
+        self.template_seconds = 0.0
+
+
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """connection.execute_wrapper hook counting queries and their time"""
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_seconds += time.perf_counter() - started
+        timings.queries += 1
+
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        timings = current_timings.get()
+        if timings is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.template_seconds += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Django template backend that reports render time to the current request"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram with running totals"""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+        self.db_ms = 0.0
+        self.queries = 0
+        self.bytes = 0
+
+    def observe(self, total_ms, db_ms, queries, size):
+        self.counts[bisect.bisect_left(BUCKETS_MS, total_ms)] += 1
+        self.count += 1
+        self.total_ms += total_ms
+        self.db_ms += db_ms
+        self.queries += queries
+        self.bytes += size
+
+    def quantile(self, fraction):
+        """
+        Upper bound of the bucket holding the given quantile. Quantiles in the
+        overflow bucket read as the last finite bound, since JSON has no
+        Infinity; buckets['+Inf'] says how many requests went past it.
+        """
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS[:-1], self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return BUCKETS_MS[-2]
+
+    def as_dict(self):
+        count = self.count or 1
+        return {
+            'requests': self.count,
+            'mean_ms': round(self.total_ms / count, 2),
+            'p50_ms': self.quantile(0.50),
+            'p95_ms': self.quantile(0.95),
+            'p99_ms': self.quantile(0.99),
+            'mean_db_ms': round(self.db_ms / count, 2),
+            'mean_queries': round(self.queries / count, 2),
+            'mean_bytes': round(self.bytes / count),
+            'buckets': {
+                ('+Inf' if bound == float('inf') else str(bound)): n
+                for bound, n in zip(BUCKETS_MS, self.counts)
+            },
+        }
+
+
+class Registry:
+    """Histograms keyed by URL name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, url_name, total_ms, db_ms, queries, size):
+        with self._lock:
+            histogram = self._histograms.get(url_name)
+            if histogram is None:
+                histogram = self._histograms[url_name] = Histogram()
+            histogram.observe(total_ms, db_ms, queries, size)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: histogram.as_dict() for name, histogram in sorted(self._histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+registry = Registry()
@@ -0,0 +1,152 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .metrics import RequestTimings, current_timings, record_query, registry
+
+logger = logging.getLogger('main.performance')
+
+# Per-request performance instrumentation.
+#
+# PerformanceMiddleware sits at the top of MIDDLEWARE and ViewTimerMiddleware
+# at the bottom, so the time between them is the view alone. Queries are
+# counted by a wrapper installed on every database connection, and template
+# time comes from main.metrics.TimedDjangoTemplates. Each response gets a
+# Server-Timing header (visible in the browser's network panel), a log line on
+# the main.performance logger, and a sample in the per-URL histograms served
+# by the metrics view.
+
+
+@receiver(connection_created)
+def _wrap_connection(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Connections opened before this module was imported
+        for connection in connections.all(initialized_only=True):
+            _wrap_connection(None, connection)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings, started)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings, started)
+
+    def finish(self, request, response, timings, started):
+        total_ms = (time.perf_counter() - started) * 1000
+        db_ms = timings.db_seconds * 1000
+        view_ms = timings.view_seconds * 1000
+        template_ms = timings.template_seconds * 1000
+        # Streamed bodies are produced after this point and are not measured
+        size = 0 if response.streaming else len(response.content)
+
+        if getattr(settings, 'PERFORMANCE_SERVER_TIMING', True):
+            response['Server-Timing'] = (
+                f'db;dur={db_ms:.1f};desc="{timings.queries} queries", '
+                f'view;dur={view_ms:.1f}, tpl;dur={template_ms:.1f}, total;dur={total_ms:.1f}'
+            )
+
+        match = request.resolver_match
+        url_name = match.view_name if match else 'unresolved'
+        registry.observe(url_name, total_ms, db_ms, timings.queries, size)
+
+        slow = total_ms >= getattr(settings, 'PERFORMANCE_SLOW_REQUEST_MS', 500)
+        logger.log(
+            logging.WARNING if slow else logging.DEBUG,
+            'url=%s method=%s status=%s total_ms=%.1f view_ms=%.1f db_ms=%.1f queries=%d tpl_ms=%.1f bytes=%d',
+            url_name, request.method, response.status_code, total_ms, view_ms, db_ms,
+            timings.queries, template_ms, size,
+        )
+        return response
+
+
+class ViewTimerMiddleware:
+    """Innermost middleware: times the view on behalf of PerformanceMiddleware"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        try:
+            return self.get_response(request)
+        finally:
+            self.record(started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        try:
+            return await self.get_response(request)
+        finally:
+            self.record(started)
+
+    def record(self, started):
+        timings = current_timings.get()
+        if timings is not None:
+            timings.view_seconds += time.perf_counter() - started
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise that can sit in an async middleware chain. The stock class is
+    sync-only, which under ASGI would push every request through a thread
+    before it reaches an async view.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-17 09:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_order_accepted_at_order_assigned_dispatch_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='locationupdate',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-17 10:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+from ._operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # Build the indexes without locking writes to the orders and history
+    # tables; CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('main', '0004_locationupdate_timestamp_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='locationupdate',
+            index=models.Index(fields=['order', '-timestamp'], name='locupdate_order_ts_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['user', '-date_created'], name='order_user_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['assigned_dispatch', '-date_created'], name='order_dispatch_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(condition=models.Q(('assigned_dispatch__isnull', True), ('status', 'pending')), fields=['-date_created'], name='order_available_idx'),
+        ),
+    ]
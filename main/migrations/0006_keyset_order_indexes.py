@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-10-17 11:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+from ._operations import AddIndexConcurrently, RemoveIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # Rebuilding the order-list indexes must not block writes to orders
+    atomic = False
+
+    dependencies = [
+        ('main', '0005_hot_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        RemoveIndexConcurrently(
+            model_name='order',
+            name='order_user_created_idx',
+        ),
+        RemoveIndexConcurrently(
+            model_name='order',
+            name='order_dispatch_created_idx',
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['user', '-date_created', '-id'], name='order_user_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['assigned_dispatch', '-date_created', '-id'], name='order_dispatch_created_idx'),
+        ),
+    ]
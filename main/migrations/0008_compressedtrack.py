@@ -0,0 +1,27 @@
+# Generated by Django 6.0 on 2026-10-17 13:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_userprofile_last_position'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompressedTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.TextField()),
+                ('times', models.TextField()),
+                ('point_count', models.IntegerField()),
+                ('raw_point_count', models.IntegerField()),
+                ('tolerance_m', models.FloatField()),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='compressed_track', to='main.order')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_compressedtrack'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compressedtrack',
+            name='archived_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 6.0 on 2026-10-17 15:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def backfill_stats(apps, schema_editor):
+    """Active order counts and per-day accepts from existing orders; deliveries start from zero"""
+    Order = apps.get_model('main', 'Order')
+    UserProfile = apps.get_model('main', 'UserProfile')
+    RiderDailyStats = apps.get_model('main', 'RiderDailyStats')
+
+    active = (
+        Order.objects.filter(status='dispatched', assigned_dispatch__isnull=False)
+        .values_list('assigned_dispatch_id').annotate(count=Count('id'))
+    )
+    for rider_id, count in active:
+        UserProfile.objects.filter(user_id=rider_id).update(active_orders=count)
+
+    accepted = (
+        Order.objects.filter(assigned_dispatch__isnull=False, accepted_at__isnull=False)
+        .annotate(day=TruncDate('accepted_at'))
+        .values_list('assigned_dispatch_id', 'day').annotate(count=Count('id'))
+    )
+    RiderDailyStats.objects.bulk_create(
+        RiderDailyStats(rider_id=rider_id, day=day, accepted=count) for rider_id, day, count in accepted
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_compressedtrack_archived_until'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='active_orders',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='RiderDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('accepted', models.IntegerField(default=0)),
+                ('delivered', models.IntegerField(default=0)),
+                ('rider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('rider', 'day'), name='riderdailystats_rider_day_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-17 11:20
+
+from django.db import migrations, models
+
+from ._operations import AddConstraintConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # The unique index over the history table is built without blocking
+    # location writes; CREATE INDEX CONCURRENTLY cannot run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('main', '0010_rider_daily_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='locationupdate',
+            name='device',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationupdate',
+            name='seq',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        AddConstraintConcurrently(
+            model_name='locationupdate',
+            constraint=models.UniqueConstraint(condition=models.Q(('device__isnull', False), ('seq__isnull', False)), fields=('device', 'seq'), name='locupdate_device_seq_uniq'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_locationupdate_device_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='delivered_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,85 @@
+from django.contrib.postgres.operations import (
+    AddIndexConcurrently as PostgresAddIndexConcurrently,
+    RemoveIndexConcurrently as PostgresRemoveIndexConcurrently,
+)
+from django.db import migrations
+
+# Index operations for migrations that must not lock the orders or location
+# history tables while they run. Migrations using them set atomic = False,
+# since PostgreSQL cannot build or drop an index concurrently inside a
+# transaction. Other backends get the plain, blocking operation.
+
+
+class AddIndexConcurrently(PostgresAddIndexConcurrently):
+    """CREATE INDEX CONCURRENTLY on PostgreSQL, a plain CREATE INDEX elsewhere"""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+class RemoveIndexConcurrently(PostgresRemoveIndexConcurrently):
+    """DROP INDEX CONCURRENTLY on PostgreSQL, a plain DROP INDEX elsewhere"""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.RemoveIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.RemoveIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+class AddConstraintConcurrently(migrations.AddConstraint):
+    """
+    A UniqueConstraint whose index is built with CREATE UNIQUE INDEX
+    CONCURRENTLY on PostgreSQL, then attached; a plain ADD CONSTRAINT
+    elsewhere.
+
+    A conditional constraint is a partial unique index, so once the index
+    exists there is nothing more to attach. Any other one is attached with
+    ADD CONSTRAINT ... USING INDEX, which does not scan the table again.
+    """
+
+    sql_create_index = (
+        'CREATE UNIQUE INDEX CONCURRENTLY %(name)s ON %(table)s '
+        '(%(columns)s)%(include)s%(nulls_distinct)s%(condition)s'
+    )
+
+    def describe(self):
+        return f'Concurrently create constraint {self.constraint.name} on model {self.model_name}'
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        statement = self.constraint.create_sql(model, schema_editor)
+        statement.template = self.sql_create_index
+        schema_editor.execute(statement)
+        if self.constraint.condition is None:
+            name = schema_editor.quote_name(self.constraint.name)
+            schema_editor.execute(
+                f'ALTER TABLE {schema_editor.quote_name(model._meta.db_table)} '
+                f'ADD CONSTRAINT {name} UNIQUE USING INDEX {name}'
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql' or self.constraint.condition is None:
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(self.constraint.name)}')
@@ -1,7 +1,13 @@
+from datetime import datetime, timezone as dt_timezone
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.utils import timezone
+
+from .polyline import decode_polyline, decode_values
+
 # Create your models here.
 
 USER_TYPE_CHOICES = (
@@ -19,6 +25,12 @@ class UserProfile(models.Model):
     is_available = models.BooleanField(default=True)  # For dispatch riders
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=5.00)
     total_deliveries = models.IntegerField(default=0)
+    active_orders = models.IntegerField(default=0)  # Dispatched and not yet delivered
+    
+    # Last known position of a dispatch rider, moved by location ingestion
+    last_latitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+    last_longitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+    last_location_update = models.DateTimeField(blank=True, null=True)
     
     def __str__(self):
         return f"{self.user.username} - {self.get_user_type_display()}"
@@ -63,14 +75,51 @@ class Order(models.Model):
     # Dispatch rider assignment
     assigned_dispatch = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="assigned_orders")
     accepted_at = models.DateTimeField(blank=True, null=True)
+    delivered_at = models.DateTimeField(blank=True, null=True)
     
     date_created = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
         return f"Order #{self.id} - {self.name}"
     
+    def location_payload(self):
+        """JSON-ready location state served by the tracking APIs and live stream"""
+        return {
+            'order_id': self.id,
+            'status': self.status,
+            'pickup': {
+                'address': self.pickup_address,
+                'latitude': float(self.pickup_latitude) if self.pickup_latitude else None,
+                'longitude': float(self.pickup_longitude) if self.pickup_longitude else None,
+            } if self.pickup_latitude and self.pickup_longitude else None,
+            'delivery': {
+                'address': self.delivery_address,
+                'latitude': float(self.delivery_latitude) if self.delivery_latitude else None,
+                'longitude': float(self.delivery_longitude) if self.delivery_longitude else None,
+            } if self.delivery_latitude and self.delivery_longitude else None,
+            'current': {
+                'latitude': float(self.current_latitude) if self.current_latitude else None,
+                'longitude': float(self.current_longitude) if self.current_longitude else None,
+                'last_update': self.last_location_update.isoformat() if self.last_location_update else None,
+            } if self.current_latitude and self.current_longitude else None,
+            # Remaining distance, speed and ETA, set by eta.attach_progress()
+            'progress': getattr(self, 'progress', None),
+        }
+    
     class Meta:
         ordering = ['-date_created']
+        indexes = [
+            # User dashboard, keyset-paginated on (date_created, id)
+            models.Index(fields=['user', '-date_created', '-id'], name='order_user_created_idx'),
+            # Rider's assigned orders on the dispatch dashboard
+            models.Index(fields=['assigned_dispatch', '-date_created', '-id'], name='order_dispatch_created_idx'),
+            # Available jobs: only the small pending/unassigned slice is indexed
+            models.Index(
+                fields=['-date_created'],
+                name='order_available_idx',
+                condition=models.Q(status='pending', assigned_dispatch__isnull=True),
+            ),
+        ]
 
 class Delivery(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="delivery")
@@ -80,16 +129,68 @@ class Delivery(models.Model):
     def __str__(self):
         return f"Delivery for Order #{self.order.id}"
 
+class RiderDailyStats(models.Model):
+    """Per-rider, per-day counters kept up to date by rider_stats"""
+    rider = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_stats')
+    day = models.DateField()
+    accepted = models.IntegerField(default=0)
+    delivered = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.rider.username} on {self.day}: {self.accepted} accepted, {self.delivered} delivered"
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['rider', 'day'], name='riderdailystats_rider_day_uniq'),
+        ]
+
 class LocationUpdate(models.Model):
     """Track delivery location history for real-time tracking"""
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="location_updates")
     latitude = models.DecimalField(max_digits=9, decimal_places=6)
     longitude = models.DecimalField(max_digits=9, decimal_places=6)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)  # Device fix time when supplied
     notes = models.CharField(max_length=255, blank=True, null=True)
+    # Uploading device and its sequence number for the fix, when supplied, so
+    # a retried upload cannot record the same fix twice
+    device = models.CharField(max_length=64, blank=True, null=True)
+    seq = models.BigIntegerField(blank=True, null=True)
     
     def __str__(self):
         return f"Location update for Order #{self.order.id} at {self.timestamp}"
     
     class Meta:
-        ordering = ['-timestamp']
\ No newline at end of file
+        ordering = ['-timestamp']
+        indexes = [
+            # Per-order history, newest first
+            models.Index(fields=['order', '-timestamp'], name='locupdate_order_ts_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['device', 'seq'], name='locupdate_device_seq_uniq',
+                condition=models.Q(device__isnull=False, seq__isnull=False),
+            ),
+        ]
+
+class CompressedTrack(models.Model):
+    """Simplified location history of a finished order, stored as encoded polylines"""
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='compressed_track')
+    points = models.TextField()  # polyline6 of (latitude, longitude)
+    times = models.TextField()  # Unix seconds, delta-encoded with the same scheme
+    point_count = models.IntegerField()
+    raw_point_count = models.IntegerField()  # Fixes recorded before simplification
+    tolerance_m = models.FloatField()
+    archived_until = models.DateTimeField(blank=True, null=True)  # Newest raw fix folded in; later ones are appended
+    date_created = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Track for Order #{self.order_id} ({self.point_count}/{self.raw_point_count} points)"
+    
+    def history(self):
+        """Decoded points, newest first, shaped like LocationUpdate for templates"""
+        points = decode_polyline(self.points)
+        times = decode_values(self.times)
+        return [
+            {'latitude': lat, 'longitude': lng, 'timestamp': datetime.fromtimestamp(ts, tz=dt_timezone.utc)}
+            for (lat, lng), ts in reversed(list(zip(points, times)))
+        ]
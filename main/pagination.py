@@ -0,0 +1,52 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+# Keyset (cursor) pagination on (date_created, id), newest first.
+# Each page is one index range scan on the (..., -date_created, -id) indexes,
+# so page N costs the same as page 1 no matter how many orders a user has.
+
+
+def encode_cursor(order):
+    """Opaque cursor pointing just past the given order"""
+    raw = f'{order.date_created.isoformat()}|{order.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (date_created, id) from a cursor, raising ValueError if it is malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        created, order_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created), int(order_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+
+def keyset_paginate(queryset, cursor, page_size):
+    """
+    Return (orders, next_cursor) for the page after cursor.
+
+    An empty or malformed cursor starts from the newest order. next_cursor is
+    None on the last page.
+    """
+    queryset = queryset.order_by('-date_created', '-id')
+    if cursor:
+        try:
+            created, order_id = decode_cursor(cursor)
+        except ValueError:
+            pass
+        else:
+            # Same as (date_created, id) < cursor, written so that the
+            # date_created bound can drive the index range scan
+            queryset = queryset.filter(
+                Q(date_created__lte=created) & ~Q(date_created=created, id__gte=order_id)
+            )
+
+    # One extra row tells us whether there is a next page without a count()
+    orders = list(queryset[:page_size + 1])
+    next_cursor = encode_cursor(orders[page_size - 1]) if len(orders) > page_size else None
+    return orders[:page_size], next_cursor
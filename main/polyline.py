@@ -0,0 +1,129 @@
+import math
+
+# Encoded-polyline codec and Douglas-Peucker simplification for rider tracks.
+#
+# Numbers use the Google encoded-polyline scheme: zig-zag signed deltas split
+# into 5-bit chunks, each written as one printable ASCII character. Points are
+# stored at 6 decimal places ("polyline6", the precision of the DecimalFields)
+# and timestamps as whole-second deltas, so a track is two short strings.
+
+PRECISION = 6
+EARTH_RADIUS_M = 6371000.0
+
+
+def encode_values(values):
+    """Encode a sequence of integers as deltas in polyline characters"""
+    chunks = []
+    previous = 0
+    for value in values:
+        _encode_number(value - previous, chunks)
+        previous = value
+    return ''.join(chunks)
+
+
+def decode_values(encoded):
+    """Inverse of encode_values"""
+    values = []
+    current = 0
+    for delta in _decode_numbers(encoded):
+        current += delta
+        values.append(current)
+    return values
+
+
+def encode_polyline(points, precision=PRECISION):
+    """Encode (lat, lng) pairs; latitudes and longitudes are delta-coded separately"""
+    factor = 10 ** precision
+    chunks = []
+    previous_lat = previous_lng = 0
+    for lat, lng in points:
+        lat = round(float(lat) * factor)
+        lng = round(float(lng) * factor)
+        _encode_number(lat - previous_lat, chunks)
+        _encode_number(lng - previous_lng, chunks)
+        previous_lat, previous_lng = lat, lng
+    return ''.join(chunks)
+
+
+def decode_polyline(encoded, precision=PRECISION):
+    """Decode to a list of (lat, lng) floats"""
+    factor = 10 ** precision
+    numbers = _decode_numbers(encoded)
+    points = []
+    lat = lng = 0
+    for i in range(0, len(numbers) - 1, 2):
+        lat += numbers[i]
+        lng += numbers[i + 1]
+        points.append((lat / factor, lng / factor))
+    return points
+
+
+def _encode_number(number, chunks):
+    number = ~(number << 1) if number < 0 else number << 1
+    while number >= 0x20:
+        chunks.append(chr((0x20 | (number & 0x1f)) + 63))
+        number >>= 5
+    chunks.append(chr(number + 63))
+
+
+def _decode_numbers(encoded):
+    numbers = []
+    shift = 0
+    chunk = 0
+    for char in encoded:
+        byte = ord(char) - 63
+        chunk |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            numbers.append(~(chunk >> 1) if chunk & 1 else chunk >> 1)
+            shift = 0
+            chunk = 0
+    return numbers
+
+
+def simplify(points, tolerance_m):
+    """
+    Douglas-Peucker simplification of (lat, lng, ...) tuples.
+
+    Keeps the first and last point and every point that lies more than
+    tolerance_m metres from the simplified line. Distances use a local
+    equirectangular projection, which is accurate at city scale.
+    """
+    if len(points) < 3 or tolerance_m <= 0:
+        return list(points)
+
+    lat0 = math.radians(sum(float(p[0]) for p in points) / len(points))
+    kx = math.cos(lat0) * math.radians(1) * EARTH_RADIUS_M
+    ky = math.radians(1) * EARTH_RADIUS_M
+    xy = [(float(p[1]) * kx, float(p[0]) * ky) for p in points]
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    tolerance_sq = tolerance_m * tolerance_m
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xy[first]
+        bx, by = xy[last]
+        dx, dy = bx - ax, by - ay
+        length_sq = dx * dx + dy * dy
+
+        farthest = None
+        farthest_sq = tolerance_sq
+        for i in range(first + 1, last):
+            px, py = xy[i]
+            if length_sq == 0:
+                ex, ey = px - ax, py - ay
+            else:
+                t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length_sq))
+                ex, ey = px - (ax + t * dx), py - (ay + t * dy)
+            distance_sq = ex * ex + ey * ey
+            if distance_sq > farthest_sq:
+                farthest, farthest_sq = i, distance_sq
+
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+
+    return [point for point, kept in zip(points, keep) if kept]
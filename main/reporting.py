@@ -0,0 +1,94 @@
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from .eta import MIN_SPEED
+from .geofence import METRES_PER_DEGREE, distance_sq, fences_for
+
+# How long a rider device should wait before its next fix.
+#
+# update_location answers every upload with next_report_seconds, computed
+# from what ingestion already has in memory: the order's recent speed (from
+# its progress) and its distance to the nearer of its pickup and drop-off
+# (from its precomputed geofences). The interval aims at one fix every
+# REPORT_SPACING_FRACTION of the remaining distance, between
+# REPORT_SPACING_MIN_M and REPORT_SPACING_MAX_M apart, so a rider closing in
+# on a stop reports densely and one cruising far away or standing still
+# reports rarely. Orders that are not being delivered, and riders who are
+# stopped, get REPORT_INTERVAL_MAX.
+#
+# Load shedding: this process counts the fixes it ingests. Above
+# REPORT_TARGET_FIXES_PER_SECOND every interval, including the
+# REPORT_INTERVAL_MIN floor, is stretched in proportion, though never beyond
+# REPORT_INTERVAL_MAX.
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class IngestRate:
+    """Fixes per second ingested by this process over the last few seconds"""
+
+    def __init__(self, window=10):
+        self._lock = threading.Lock()
+        self._window = window
+        self._counts = [0] * window
+        self._seconds = [0] * window
+
+    def observe(self, fixes, now=None):
+        second = int(now if now is not None else time.monotonic())
+        slot = second % self._window
+        with self._lock:
+            if self._seconds[slot] != second:
+                self._seconds[slot] = second
+                self._counts[slot] = 0
+            self._counts[slot] += fixes
+
+    def per_second(self, now=None):
+        second = int(now if now is not None else time.monotonic())
+        with self._lock:
+            total = sum(
+                count for count, seen in zip(self._counts, self._seconds)
+                if second - seen < self._window
+            )
+        return total / self._window
+
+
+ingest_rate = IngestRate()
+
+
+def load_factor():
+    """1.0 at or below the target ingest rate, proportionally more above it"""
+    target = _setting('REPORT_TARGET_FIXES_PER_SECOND', 200)
+    return max(1.0, ingest_rate.per_second() / target) if target else 1.0
+
+
+def nearest_stop_m(order):
+    """Metres from the order's current position to its nearer fence, or None"""
+    if order.current_latitude is None or order.current_longitude is None:
+        return None
+    latitude, longitude = float(order.current_latitude), float(order.current_longitude)
+    distances = [distance_sq(fence, latitude, longitude) for fence in fences_for(order)]
+    return math.sqrt(min(distances)) * METRES_PER_DEGREE if distances else None
+
+
+def report_interval(order, load=None):
+    """Seconds the order's rider should wait before the next fix"""
+    shortest = _setting('REPORT_INTERVAL_MIN', 5)
+    longest = _setting('REPORT_INTERVAL_MAX', 60)
+    progress = getattr(order, 'progress', None)
+    speed_kmh = progress['speed_kmh'] if progress else None
+    if order.status != 'dispatched' or speed_kmh is None or speed_kmh / 3.6 < MIN_SPEED:
+        return longest
+
+    distance = nearest_stop_m(order)
+    spacing = _setting('REPORT_SPACING_MAX_M', 500)
+    if distance is not None:
+        spacing = min(max(distance * _setting('REPORT_SPACING_FRACTION', 0.1),
+                          _setting('REPORT_SPACING_MIN_M', 30)), spacing)
+    load = load_factor() if load is None else load
+    interval = spacing / (speed_kmh / 3.6) * load
+    return round(min(max(interval, shortest * load), longest))
@@ -0,0 +1,78 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .compaction import default_tolerance, fold_into_track
+from .models import Order, LocationUpdate
+
+# Retention policy for raw rider history (LocationUpdate).
+#
+# Fixes older than LOCATION_RETENTION_DAYS that belong to orders in
+# LOCATION_RETENTION_STATUSES are folded into the order's CompressedTrack,
+# which serves as the per-order archive, and the raw rows are then deleted by
+# primary key, LOCATION_RETENTION_BATCH_SIZE at a time. No statement holds
+# locks on more than one batch.
+#
+# Each batch is folded in and deleted in the same short transaction, so a row
+# is either still stored raw or part of the track, never both. An interrupted
+# run leaves nothing to tidy up, and late or backdated fixes (older than what
+# the track already holds) are simply folded in by the next run.
+
+
+def retention_cutoff(days=None):
+    if days is None:
+        days = getattr(settings, 'LOCATION_RETENTION_DAYS', 30)
+    return timezone.now() - timedelta(days=days)
+
+
+def retention_statuses():
+    return getattr(settings, 'LOCATION_RETENTION_STATUSES', ['delivered'])
+
+
+def default_batch_size():
+    return getattr(settings, 'LOCATION_RETENTION_BATCH_SIZE', 1000)
+
+
+def expired_orders(before, statuses=None):
+    """Orders covered by the policy that still have raw fixes older than before"""
+    return (
+        Order.objects
+        .filter(status__in=statuses or retention_statuses())
+        .filter(Exists(LocationUpdate.objects.filter(order=OuterRef('pk'), timestamp__lt=before)))
+        .order_by('id')
+    )
+
+
+def archive_order(order, before, batch_size=None, tolerance_m=None, pause=0):
+    """
+    Roll the order's fixes older than before into its track and delete them.
+
+    Returns (archived, deleted): the number of fixes folded into the track
+    and the number of raw rows removed.
+    """
+    if batch_size is None:
+        batch_size = default_batch_size()
+    if tolerance_m is None:
+        tolerance_m = default_tolerance()
+
+    rows = list(
+        LocationUpdate.objects
+        .filter(order=order, timestamp__lt=before)
+        .order_by('timestamp', 'id')
+        .values_list('id', 'latitude', 'longitude', 'timestamp')
+    )
+    deleted = 0
+    for start in range(0, len(rows), batch_size):
+        if start and pause:
+            time.sleep(pause)
+        batch = rows[start:start + batch_size]
+        with transaction.atomic():
+            fold_into_track(order, batch, tolerance_m)
+            count, _ = LocationUpdate.objects.filter(id__in=[row[0] for row in batch]).delete()
+        deleted += count
+
+    return len(rows), deleted
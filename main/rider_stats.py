@@ -0,0 +1,51 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import UserProfile, RiderDailyStats
+
+# Materialized rider statistics. Every counter is changed with an F()
+# expression in a single UPDATE, so concurrent accepts and deliveries add up
+# instead of overwriting each other, and the dispatch dashboard reads them
+# back with one lookup on (rider, day) instead of aggregating orders.
+
+
+def _bump_day(rider_id, **deltas):
+    day = timezone.localdate()
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if RiderDailyStats.objects.filter(rider_id=rider_id, day=day).update(**changes):
+        return
+    try:
+        # Savepoint so a lost race does not break an enclosing transaction
+        with transaction.atomic():
+            RiderDailyStats.objects.create(rider_id=rider_id, day=day, **deltas)
+    except IntegrityError:
+        # Another request created today's row first
+        RiderDailyStats.objects.filter(rider_id=rider_id, day=day).update(**changes)
+
+
+def record_accepted(rider_id, count=1):
+    """Count count newly accepted orders for the rider"""
+    UserProfile.objects.filter(user_id=rider_id).update(active_orders=F('active_orders') + count)
+    _bump_day(rider_id, accepted=count)
+
+
+def record_delivered(rider_id):
+    """Count one completed delivery for the rider"""
+    UserProfile.objects.filter(user_id=rider_id).update(
+        total_deliveries=F('total_deliveries') + 1,
+        active_orders=Greatest(F('active_orders') - 1, 0),
+    )
+    _bump_day(rider_id, delivered=1)
+
+
+def today_stats(rider_id):
+    """Today's (accepted, delivered) counts for the rider"""
+    row = (
+        RiderDailyStats.objects
+        .filter(rider_id=rider_id, day=timezone.localdate())
+        .values_list('accepted', 'delivered')
+        .first()
+    )
+    return row or (0, 0)
@@ -0,0 +1,152 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+
+# Read-replica routing.
+#
+# Views marked with @replica_reads read from one of settings.DATABASE_REPLICAS;
+# every other read, and every write, goes to the primary ('default'). Reads
+# made outside a request (management commands, the write-behind flusher) also
+# use the primary.
+#
+# ReplicaRoutingMiddleware keeps the per-request state. Once a request has
+# written, the rest of it reads from the primary, and the response sets a
+# short-lived cookie that pins the client to the primary for
+# DATABASE_REPLICA_PIN_SECONDS, so the user's next requests see their own
+# writes even while the replicas lag behind. A cookie rather than the session
+# keeps the pin free of database writes on the hot update_location path.
+# Reads inside a transaction stay on the primary so they see its writes, and
+# sessions are always read from the primary: a session created moments ago
+# may not have reached a replica yet.
+#
+# Code that caches what it reads (the location snapshots, the fleet snapshot,
+# the available-orders index) loads it inside primary_reads(): a row read
+# from a lagging replica would otherwise be served long after the replica
+# caught up.
+
+PIN_COOKIE = 'db_pin'
+
+PRIMARY_ONLY_APPS = {'sessions'}
+
+
+class RoutingState:
+    """What the router needs to know about the request being served"""
+    __slots__ = ('pinned', 'replica', 'wrote')
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.replica = False
+        self.wrote = False
+
+
+current_routing = ContextVar('current_routing', default=None)
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def _in_transaction():
+    """Whether the primary is inside a transaction; TestCase's own wrappers don't count"""
+    return any(not block._from_testcase for block in connection.atomic_blocks)
+
+
+def replica_reads(view):
+    """Mark a view as read-only so its queries may be served by a replica"""
+    view.replica_reads = True
+    return view
+
+
+@contextmanager
+def primary_reads():
+    """Send the block's reads to the primary, even inside a @replica_reads view"""
+    state = current_routing.get()
+    if state is None or not state.replica:
+        yield
+        return
+    state.replica = False
+    try:
+        yield
+    finally:
+        state.replica = True
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = current_routing.get()
+        if state is None or not state.replica or state.pinned or state.wrote:
+            return None
+        if model._meta.app_label in PRIMARY_ONLY_APPS or _in_transaction():
+            return None
+        replicas = replica_aliases()
+        return random.choice(replicas) if replicas else None
+
+    def db_for_write(self, model, **hints):
+        state = current_routing.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {'default', *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        if db in replica_aliases():
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState(pinned=PIN_COOKIE in request.COOKIES)
+        token = current_routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.finish(response, state)
+
+    async def __acall__(self, request):
+        state = RoutingState(pinned=PIN_COOKIE in request.COOKIES)
+        token = current_routing.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.finish(response, state)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = current_routing.get()
+        if state is not None and getattr(view_func, 'replica_reads', False):
+            state.replica = bool(replica_aliases())
+        return None
+
+    def finish(self, response, state):
+        if state.wrote and replica_aliases():
+            seconds = getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 5)
+            response.set_cookie(
+                PIN_COOKIE, int(time.time() + seconds), max_age=seconds,
+                httponly=True, samesite='Lax',
+            )
+        return response
@@ -0,0 +1,11 @@
+from django.dispatch import Signal
+
+# Sent by main.ingestion after a batch of fixes has been recorded.
+#   orders: Order instances whose current position moved, already updated
+#   fixes:  every accepted Fix, in the order the device produced them
+locations_recorded = Signal()
+
+# Sent by main.geofence when fixes cross an order's pickup or delivery fence.
+#   events: GeofenceEvent tuples (order_id, fence, kind, timestamp, latitude,
+#           longitude), kind being 'arrival' or 'departure'
+geofence_crossed = Signal()
@@ -0,0 +1,114 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.http import quote_etag
+
+from .eta import attach_progress
+from .ingestion import apply_buffered_position
+from .models import Order
+from .signals import locations_recorded
+
+# Prebuilt get_order_location responses, one per order, kept in the cache
+# named by ORDER_SNAPSHOT_CACHE. Each entry holds the owner's user id, the
+# encoded JSON body and its validators (an ETag hashed from the body and the
+# time the order last changed), so a poll is answered with a single cache get: no order
+# query and no serialization, and no body at all when the client's copy is
+# still current.
+#
+# Ingestion and Order.save() rebuild the entry; code paths that use
+# queryset.update() call invalidate_snapshot() and the next poll rebuilds it.
+#
+# Those rebuilds only reach the process that made them, so with more than one
+# worker the cache must be shared (Redis, Memcached, the database). A
+# per-process LocMemCache is only right for a single process; the system
+# check below warns when the snapshot cache is one.
+
+
+def _cache():
+    return caches[getattr(settings, 'ORDER_SNAPSHOT_CACHE', 'default')]
+
+
+def _ttl():
+    return getattr(settings, 'ORDER_SNAPSHOT_TTL', 300)
+
+
+@checks.register(checks.Tags.caches)
+def check_snapshot_cache(app_configs, **kwargs):
+    if not isinstance(_cache(), LocMemCache):
+        return []
+    return [checks.Warning(
+        'ORDER_SNAPSHOT_CACHE is a per-process LocMemCache.',
+        hint='Other workers keep serving an order\'s old position until its snapshot expires, '
+             'and geofence and ETA state is split between them. Set REDIS_URL, or point '
+             'ORDER_SNAPSHOT_CACHE at another shared cache, when running more than one worker.',
+        id='main.W001',
+    )]
+
+
+def _key(order_id):
+    return f'order-location:v2:{order_id}'
+
+
+def last_modified(order):
+    """When the order last changed: its newest fix or its latest status change"""
+    changes = [order.last_location_update, order.accepted_at, order.delivered_at]
+    return int(max(filter(None, changes), default=order.date_created).timestamp())
+
+
+def build_snapshot(order):
+    if not hasattr(order, 'progress'):
+        attach_progress([order])
+    body = json.dumps({'success': True, **order.location_payload()}, separators=(',', ':')).encode()
+    return {
+        'user_id': order.user_id,
+        'body': body,
+        'etag': quote_etag(hashlib.blake2b(body, digest_size=12).hexdigest()),
+        'last_modified': last_modified(order),
+    }
+
+
+def get_snapshot(order_id):
+    return _cache().get(_key(order_id))
+
+
+async def aget_snapshot(order_id):
+    return await _cache().aget(_key(order_id))
+
+
+def refresh_snapshot(order):
+    snapshot = build_snapshot(order)
+    _cache().set(_key(order.id), snapshot, _ttl())
+    return snapshot
+
+
+def refresh_snapshots(orders):
+    if orders:
+        _cache().set_many(
+            {_key(order.id): build_snapshot(order) for order in orders},
+            _ttl(),
+        )
+
+
+def invalidate_snapshot(order_id):
+    _cache().delete(_key(order_id))
+
+
+@receiver(locations_recorded, sender=Order)
+def refresh_moved_orders(sender, orders, **kwargs):
+    refresh_snapshots(orders)
+
+
+@receiver(post_save, sender=Order)
+def refresh_saved_order(sender, instance, **kwargs):
+    refresh_snapshot(apply_buffered_position(instance))
+
+
+@receiver(post_delete, sender=Order)
+def drop_deleted_order(sender, instance, **kwargs):
+    invalidate_snapshot(instance.id)
@@ -0,0 +1,221 @@
+import math
+import threading
+import time
+from collections import defaultdict
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Order
+from .routing import primary_reads
+
+# In-process grid index over the pickup points of available orders (pending
+# and unassigned), used to rank jobs by distance to a rider.
+#
+# Points are bucketed into fixed-size lat/lng cells. A nearest query walks
+# rings of cells outwards from the rider and stops as soon as no unvisited
+# cell can hold anything closer than the k-th best candidate, so the cost
+# depends on the orders near the rider, not on the total number of orders.
+#
+# Orders created or changed through save() are picked up by signals; code
+# paths that use queryset.update() call available_orders.discard(). The grid
+# is rebuilt from the database every REFRESH_SECONDS so that changes made by
+# other processes are picked up too.
+
+CELL_DEGREES = 0.01  # ~1.1 km of latitude
+REFRESH_SECONDS = 60
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def _cell(lat, lng):
+    return (math.floor(lat / CELL_DEGREES), math.floor(lng / CELL_DEGREES))
+
+
+class GridIndex:
+    """Thread-safe uniform grid of (id -> lat, lng) points"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cells = defaultdict(dict)
+        self._points = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, key):
+        return key in self._points
+
+    def add(self, key, lat, lng):
+        with self._lock:
+            self._remove(key)
+            cell = _cell(lat, lng)
+            self._cells[cell][key] = (lat, lng)
+            self._points[key] = cell
+
+    def discard(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def replace(self, points):
+        """Swap in a new set of (key, lat, lng) points in one step"""
+        cells = defaultdict(dict)
+        index = {}
+        for key, lat, lng in points:
+            cell = _cell(lat, lng)
+            cells[cell][key] = (lat, lng)
+            index[key] = cell
+        with self._lock:
+            self._cells = cells
+            self._points = index
+
+    def nearest(self, lat, lng, k):
+        """Return up to k (distance_km, key) pairs, closest first"""
+        with self._lock:
+            if not self._points or k <= 0:
+                return []
+            return self._nearest(lat, lng, k)
+
+    def _remove(self, key):
+        cell = self._points.pop(key, None)
+        if cell is not None:
+            bucket = self._cells[cell]
+            bucket.pop(key, None)
+            if not bucket:
+                del self._cells[cell]
+
+    def _nearest(self, lat, lng, k):
+        row, col = _cell(lat, lng)
+        # Smallest real-world size of one ring step around this latitude
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + CELL_DEGREES, 90))), 1e-6)
+        step_km = math.radians(CELL_DEGREES) * EARTH_RADIUS_KM * cos_lat
+
+        best = []
+        seen = 0
+        ring = 0
+        while True:
+            if (2 * ring + 1) ** 2 > 4 * len(self._cells):
+                # Sparse grid: cheaper to look at the remaining cells directly
+                for (r, c), bucket in self._cells.items():
+                    if max(abs(r - row), abs(c - col)) >= ring:
+                        best.extend(self._measure(lat, lng, bucket))
+                break
+
+            for cell in _ring_cells(row, col, ring):
+                bucket = self._cells.get(cell)
+                if bucket:
+                    best.extend(self._measure(lat, lng, bucket))
+                    seen += len(bucket)
+
+            if len(best) >= k:
+                best.sort()
+                del best[k:]
+                # Anything in an unvisited ring is at least ring * step_km away
+                if best[-1][0] <= ring * step_km:
+                    return best
+            if seen == len(self._points):
+                break
+            ring += 1
+
+        best.sort()
+        return best[:k]
+
+    @staticmethod
+    def _measure(lat, lng, bucket):
+        return [(haversine_km(lat, lng, plat, plng), key) for key, (plat, plng) in bucket.items()]
+
+
+def _ring_cells(row, col, ring):
+    if ring == 0:
+        yield (row, col)
+        return
+    for c in range(col - ring, col + ring + 1):
+        yield (row - ring, c)
+        yield (row + ring, c)
+    for r in range(row - ring + 1, row + ring):
+        yield (r, col - ring)
+        yield (r, col + ring)
+
+
+class AvailableOrdersIndex:
+    """Pickup points of pending, unassigned orders"""
+
+    def __init__(self):
+        self.grid = GridIndex()
+        self._loaded_at = None
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self):
+        points = (
+            Order.objects
+            .filter(status='pending', assigned_dispatch__isnull=True,
+                    pickup_latitude__isnull=False, pickup_longitude__isnull=False)
+            .values_list('id', 'pickup_latitude', 'pickup_longitude')
+        )
+        # Kept for REFRESH_SECONDS, so never from a lagging replica
+        with primary_reads():
+            self.grid.replace((order_id, float(lat), float(lng)) for order_id, lat, lng in points.iterator())
+        self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < REFRESH_SECONDS:
+            return
+        with self._refresh_lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= REFRESH_SECONDS:
+                self.refresh()
+
+    def sync(self, order):
+        """Add or drop an order depending on whether it is still available"""
+        if self._loaded_at is None:
+            return  # Nothing loaded yet; the first query loads from the DB
+        if (order.status == 'pending' and order.assigned_dispatch_id is None
+                and order.pickup_latitude is not None and order.pickup_longitude is not None):
+            self.grid.add(order.id, float(order.pickup_latitude), float(order.pickup_longitude))
+        else:
+            self.grid.discard(order.id)
+
+    def discard(self, order_id):
+        self.grid.discard(order_id)
+
+    def nearest(self, lat, lng, k):
+        """
+        Return up to k available orders closest to (lat, lng), closest first,
+        each annotated with distance_km.
+        """
+        self._ensure_fresh()
+        # Ask for a few spares in case another process took some of them
+        candidates = self.grid.nearest(lat, lng, k + max(k // 2, 5))
+        if not candidates:
+            return []
+
+        ids = [order_id for _, order_id in candidates]
+        orders = Order.objects.filter(id__in=ids, status='pending', assigned_dispatch__isnull=True).in_bulk()
+        ranked = []
+        for distance, order_id in candidates:
+            order = orders.get(order_id)
+            if order is None:
+                self.grid.discard(order_id)
+                continue
+            order.distance_km = round(distance, 2)
+            ranked.append(order)
+            if len(ranked) == k:
+                break
+        return ranked
+
+
+available_orders = AvailableOrdersIndex()
+
+
+@receiver(post_save, sender=Order)
+def sync_available_order(sender, instance, **kwargs):
+    available_orders.sync(instance)
+
+
+@receiver(post_delete, sender=Order)
+def drop_available_order(sender, instance, **kwargs):
+    available_orders.discard(instance.id)
@@ -1,3 +1,1217 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+from decimal import Decimal
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date
+
+from .assignment import claim_order
+from .broker import broker, encode_event
+from .compaction import fold_into_track
+from .dispatcher import dispatch_tick, match
+from .eta import haversine_m
+from .fleet import fleet
+from .signals import geofence_crossed
+from .snapshots import check_snapshot_cache
+from .metrics import registry as metrics_registry
+from .models import Order, LocationUpdate, CompressedTrack, UserProfile
+from .pagination import keyset_paginate
+from .reporting import IngestRate, report_interval
+from .retention import archive_order, retention_cutoff
+from .rider_stats import today_stats
+from .spatial import GridIndex, available_orders as available_orders_index, haversine_km
+from .routing import PIN_COOKIE, ReplicaRouter, ReplicaRoutingMiddleware, primary_reads, replica_reads
+from .polyline import encode_polyline, decode_polyline, encode_values, decode_values, simplify
+from .wire import CONTENT_TYPE as BINARY_FIXES, decode_fixes, encode_fixes
+from .write_behind import location_buffer
 
 # Create your tests here.
+
+# Rows of location history seeded for the query plan tests. The default keeps
+# the suite quick; set QUERY_PLAN_ROWS=2000000 to check plans at production size.
+QUERY_PLAN_ROWS = int(os.environ.get('QUERY_PLAN_ROWS', 20000))
+
+
+def create_rider(username='rider'):
+    rider = User.objects.create_user(username, f'{username}@example.com', 'pw')
+    rider.profile.user_type = 'dispatch'
+    rider.profile.save()
+    return rider
+
+
+class BatchUpdateLocationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        cls.rider = create_rider()
+        cls.orders = [
+            Order.objects.create(user=cls.customer, name=f'Parcel {i}', description='Batch ingestion test',
+                                 status='dispatched', assigned_dispatch=cls.rider)
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.rider)
+
+    def post_batch(self, fixes):
+        return self.client.post('/api/update-location/batch/', json.dumps({'fixes': fixes}),
+                                content_type='application/json')
+
+    def test_results_follow_request_order(self):
+        first, second = (order.id for order in self.orders)
+        response = self.post_batch([
+            {'order_id': first, 'latitude': 6.5, 'longitude': 3.3, 'timestamp': '2025-12-11T12:30:05Z'},
+            {'order_id': first, 'latitude': 6.4, 'longitude': 3.2, 'timestamp': '2025-12-11T12:30:00Z'},
+            {'order_id': second, 'latitude': 91, 'longitude': 3.3},
+            {'order_id': second, 'longitude': 3.3},
+            'not a fix',
+            {'order_id': second + 100, 'latitude': 6.6, 'longitude': 3.4},
+            {'order_id': second, 'latitude': 6.6, 'longitude': 3.4},
+        ])
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['accepted'], 3)
+        self.assertEqual(
+            [(result['success'], result['order_id'], result.get('error')) for result in data['results']],
+            [
+                (True, first, None),
+                (True, first, None),
+                (False, second, 'Invalid coordinates'),
+                (False, second, 'Missing coordinates'),
+                (False, None, 'Invalid fix'),
+                (False, second + 100, 'Order not found'),
+                (True, second, None),
+            ],
+        )
+        self.assertEqual(data['results'][0]['timestamp'], '2025-12-11T12:30:05+00:00')
+        self.assertEqual(LocationUpdate.objects.count(), 3)
+        # The order moves to its newest fix, not the last one sent
+        self.orders[0].refresh_from_db()
+        self.assertEqual(self.orders[0].current_latitude, Decimal('6.5'))
+
+    def test_bad_requests(self):
+        self.assertEqual(self.post_batch([]).status_code, 400)
+        fix = {'order_id': self.orders[0].id, 'latitude': 6.5, 'longitude': 3.3}
+        self.assertEqual(self.post_batch([fix] * 501).status_code, 400)
+        response = self.client.post('/api/update-location/batch/', '{', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(LocationUpdate.objects.count(), 0)
+
+    def test_only_the_assigned_rider_may_post(self):
+        fix = {'order_id': self.orders[0].id, 'latitude': 6.5, 'longitude': 3.3}
+        url = f'/api/update-location/{self.orders[0].id}/'
+        for user in (None, self.customer, create_rider('other')):
+            self.client.logout()
+            if user is not None:
+                self.client.force_login(user)
+            batch = self.post_batch([fix])
+            single = self.client.post(url, json.dumps(fix), content_type='application/json')
+            binary = self.client.post(url, encode_fixes(fix['order_id'], [(timezone.now(), 6.5, 3.3)]),
+                                      content_type=BINARY_FIXES)
+            if user is None or user == self.customer:
+                self.assertEqual((batch.status_code, single.status_code, binary.status_code), (403, 403, 403))
+            else:
+                # Another rider's order looks like no order at all
+                self.assertEqual(batch.json()['results'][0]['error'], 'Order not found')
+                self.assertEqual((single.status_code, binary.status_code), (404, 404))
+        self.assertEqual(LocationUpdate.objects.count(), 0)
+
+    def test_failed_write_leaves_no_history(self):
+        fix = {'order_id': self.orders[0].id, 'latitude': 6.5, 'longitude': 3.3}
+        with mock.patch('main.ingestion._advance_riders', side_effect=RuntimeError('database went away')):
+            response = self.post_batch([fix, fix])
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(LocationUpdate.objects.count(), 0)
+        self.orders[0].refresh_from_db()
+        self.assertIsNone(self.orders[0].current_latitude)
+
+
+class LocationStreamTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        cls.rider = create_rider()
+        cls.order = Order.objects.create(user=cls.customer, name='Parcel', description='Stream test',
+                                         status='dispatched', assigned_dispatch=cls.rider)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_wsgi_requests_are_told_to_poll(self):
+        self.client.force_login(self.customer)
+        response = self.client.get(f'/api/stream-location/{self.order.id}/')
+        self.assertEqual(response.status_code, 406)
+        self.assertEqual(broker.watcher_count(), 0)
+
+    async def test_stream_pushes_recorded_positions(self):
+        client = AsyncClient()
+        await client.aforce_login(self.customer)
+        response = await client.get(f'/api/stream-location/{self.order.id}/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        try:
+            initial = json.loads((await anext(events)).removeprefix(b'data: '))
+            self.assertEqual((initial['order_id'], initial['current']), (self.order.id, None))
+            self.assertEqual(broker.watcher_count(self.order.id), 1)
+
+            rider = AsyncClient()
+            await rider.aforce_login(self.rider)
+            await rider.post(f'/api/update-location/{self.order.id}/', json.dumps({'latitude': 6.5, 'longitude': 3.3}),
+                             content_type='application/json')
+            moved = json.loads((await asyncio.wait_for(anext(events), 5)).removeprefix(b'data: '))
+            self.assertEqual(moved['current']['latitude'], 6.5)
+        finally:
+            # Hang up the way the ASGI handler does, by cancelling the pending read
+            waiting = asyncio.ensure_future(anext(events))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+        self.assertEqual(broker.watcher_count(), 0)
+
+    async def test_slow_watchers_get_only_the_newest_event(self):
+        entry = broker.subscribe(self.order.id)
+        try:
+            for latitude in (6.1, 6.2):
+                # Ingestion publishes from the ORM's thread
+                await sync_to_async(broker.publish, thread_sensitive=False)(self.order.id, {'latitude': latitude})
+            await asyncio.sleep(0)
+            queue = entry[1]
+            self.assertEqual(queue.qsize(), 1)
+            self.assertEqual(queue.get_nowait(), encode_event({'latitude': 6.2}))
+        finally:
+            broker.unsubscribe(self.order.id, entry)
+        self.assertEqual(broker.watcher_count(), 0)
+
+
+class HotPathQueryPlanTests(TestCase):
+    """The dashboard and tracking queries must be served from their indexes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        cls.rider = User.objects.create_user('rider', 'rider@example.com', 'pw')
+
+        now = timezone.now()
+        order_count = max(QUERY_PLAN_ROWS // 50, 100)
+        statuses = ['delivered'] * 18 + ['dispatched', 'pending']
+        Order.objects.bulk_create(
+            (
+                Order(
+                    user=cls.customer,
+                    name=f'Order {i}',
+                    description='Seeded for query plan tests',
+                    status=statuses[i % len(statuses)],
+                    assigned_dispatch=None if statuses[i % len(statuses)] == 'pending' else cls.rider,
+                )
+                for i in range(order_count)
+            ),
+            batch_size=2000,
+        )
+        order_ids = list(Order.objects.values_list('id', flat=True))
+        cls.order_id = order_ids[0]
+
+        batch = []
+        for i in range(QUERY_PLAN_ROWS):
+            batch.append(LocationUpdate(
+                order_id=order_ids[i % len(order_ids)],
+                latitude=6.5,
+                longitude=3.3,
+                timestamp=now - timedelta(seconds=i),
+            ))
+            if len(batch) == 5000:
+                LocationUpdate.objects.bulk_create(batch)
+                batch = []
+        LocationUpdate.objects.bulk_create(batch)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        # The index already yields rows in the requested order
+        self.assertNotIn('TEMP B-TREE', plan.upper())
+        self.assertNotIn('SORT KEY', plan.upper())
+
+    def test_location_history(self):
+        self.assertUsesIndex(
+            LocationUpdate.objects.filter(order_id=self.order_id)[:50],
+            'locupdate_order_ts_idx',
+        )
+
+    def test_user_dashboard(self):
+        self.assertUsesIndex(
+            Order.objects.filter(user=self.customer).order_by('-date_created')[:20],
+            'order_user_created_idx',
+        )
+
+    def test_keyset_next_page(self):
+        first_page, cursor = keyset_paginate(Order.objects.filter(user=self.customer), None, 20)
+        self.assertUsesIndex(
+            Order.objects.filter(user=self.customer, date_created__lte=first_page[-1].date_created)
+            .exclude(date_created=first_page[-1].date_created, id__gte=first_page[-1].id)
+            .order_by('-date_created', '-id')[:21],
+            'order_user_created_idx',
+        )
+
+    def test_assigned_orders(self):
+        self.assertUsesIndex(
+            Order.objects.filter(assigned_dispatch=self.rider).order_by('-date_created')[:10],
+            'order_dispatch_created_idx',
+        )
+
+    def test_available_orders(self):
+        queryset = Order.objects.filter(status='pending', assigned_dispatch__isnull=True).order_by('-date_created')[:20]
+        if connection.vendor == 'postgresql':
+            self.assertUsesIndex(queryset, 'order_available_idx')
+        else:
+            # SQLite only matches partial indexes against literals, not bound
+            # parameters, so the planner falls back to the dispatch index
+            self.assertUsesIndex(queryset, 'order_dispatch_created_idx')
+
+
+class DashboardTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        created = timezone.now()
+        # Identical timestamps make sure the id tie-breaker is honoured
+        orders = Order.objects.bulk_create(
+            Order(user=cls.customer, name=f'Order {i}', description='Dashboard test', status='pending')
+            for i in range(45)
+        )
+        Order.objects.filter(id__in=[order.id for order in orders]).update(date_created=created)
+
+    def setUp(self):
+        self.client.force_login(self.customer)
+
+    def test_pages_cover_every_order_once(self):
+        seen = []
+        cursor = ''
+        while True:
+            response = self.client.get('/dashboard/', {'cursor': cursor} if cursor else {})
+            self.assertEqual(response.context['stats']['total_orders'], 45)
+            seen.extend(order.id for order in response.context['orders'])
+            cursor = response.context['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 45)
+        self.assertEqual(seen, sorted(set(seen), reverse=True))
+
+    def test_stats_and_page_queries(self):
+        # session + user + one aggregate + one page
+        with self.assertNumQueries(4):
+            self.client.get('/dashboard/')
+
+
+class AcceptOrderTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        cls.riders = []
+        for name in ('first', 'second'):
+            rider = User.objects.create_user(name, f'{name}@example.com', 'pw')
+            rider.profile.user_type = 'dispatch'
+            rider.profile.save()
+            cls.riders.append(rider)
+        cls.order = Order.objects.create(user=cls.customer, name='Parcel', description='Accept order test')
+
+    def test_only_first_claim_wins(self):
+        self.assertTrue(claim_order(self.order.id, self.riders[0]))
+        self.assertFalse(claim_order(self.order.id, self.riders[1]))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.assigned_dispatch, self.riders[0])
+        self.assertEqual(self.order.status, 'dispatched')
+
+    def test_accept_and_delivery_update_rider_stats(self):
+        rider = self.riders[0]
+        self.client.force_login(rider)
+        self.client.get(f'/dispatch/accept/{self.order.id}/')
+        self.assertEqual(today_stats(rider.id), (1, 0))
+        self.assertEqual(UserProfile.objects.get(user=rider).active_orders, 1)
+
+        # A repeated submit must not count the delivery twice
+        self.client.get(f'/dispatch/complete/{self.order.id}/')
+        self.client.get(f'/dispatch/complete/{self.order.id}/')
+        profile = UserProfile.objects.get(user=rider)
+        self.assertEqual((profile.total_deliveries, profile.active_orders), (1, 0))
+        self.assertEqual(today_stats(rider.id), (1, 1))
+
+        response = self.client.get('/dispatch/')
+        self.assertEqual(response.context['stats']['completed_today'], 1)
+
+    def test_losing_rider_is_sent_back(self):
+        claim_order(self.order.id, self.riders[0])
+        self.client.force_login(self.riders[1])
+        response = self.client.get(f'/dispatch/accept/{self.order.id}/')
+        self.assertRedirects(response, '/dispatch/', fetch_redirect_response=False)
+
+
+class NearbyOrdersTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        cls.rider = User.objects.create_user('rider', 'rider@example.com', 'pw')
+        cls.rider.profile.user_type = 'dispatch'
+        cls.rider.profile.save()
+        # Pickups 0.5, 1.5, 2.5 ... km north of the rider, created in reverse
+        cls.orders = [
+            Order.objects.create(
+                user=cls.customer, name=f'Parcel {i}', description='Nearby orders test',
+                pickup_latitude=Decimal(f'{6.5 + (i + 0.5) / 111.2:.6f}'), pickup_longitude=Decimal('3.3'),
+            )
+            for i in reversed(range(6))
+        ][::-1]
+
+    def setUp(self):
+        available_orders_index.refresh()
+        self.client.force_login(self.rider)
+
+    def test_grid_matches_brute_force(self):
+        grid = GridIndex()
+        points = [(i, 6 + (i * 7919 % 1000) / 2000, 3 + (i * 104729 % 1000) / 2000) for i in range(500)]
+        grid.replace(points)
+        for lat, lng in ((6.2, 3.2), (6.0, 3.0), (5.0, 2.0)):
+            expected = sorted((haversine_km(lat, lng, plat, plng), key) for key, plat, plng in points)[:10]
+            self.assertEqual(grid.nearest(lat, lng, 10), expected)
+        self.assertEqual(grid.nearest(6.2, 3.2, 0), [])
+
+    def test_closest_first(self):
+        response = self.client.get('/api/nearby-orders/', {'latitude': 6.5, 'longitude': 3.3, 'k': 3})
+        self.assertEqual(response.status_code, 200)
+        orders = response.json()['orders']
+        self.assertEqual([order['order_id'] for order in orders], [order.id for order in self.orders[:3]])
+        self.assertEqual([order['distance_km'] for order in orders], [0.5, 1.5, 2.5])
+
+    def test_invalid_coordinates(self):
+        for latitude, longitude in (('nan', '3.3'), ('6.5', 'inf'), ('-inf', '3.3'), ('91', '3.3'), ('6.5', '-180.5'), ('x', '3.3')):
+            response = self.client.get('/api/nearby-orders/', {'latitude': latitude, 'longitude': longitude})
+            self.assertEqual(response.status_code, 400, (latitude, longitude))
+
+    def test_invalid_k(self):
+        for k in ('0', '-1', 'x'):
+            response = self.client.get('/api/nearby-orders/', {'latitude': 6.5, 'longitude': 3.3, 'k': k})
+            self.assertEqual(response.status_code, 400, k)
+        response = self.client.get('/api/nearby-orders/', {'latitude': 6.5, 'longitude': 3.3, 'k': 1000})
+        self.assertEqual(len(response.json()['orders']), 6)
+
+
+class BenchmarkCommandTests(TransactionTestCase):
+    # The benchmarks' read-only views may be routed to a replica
+    databases = '__all__'
+
+    def test_concurrent_accepts_have_one_winner(self):
+        # Raises CommandError unless each order ends up with exactly one winner
+        call_command('bench_accept', riders=4, orders=5, stdout=io.StringIO())
+
+    def test_loadtest_reports_every_endpoint(self):
+        out = io.StringIO()
+        call_command('loadtest', riders=2, watchers=2, iterations=4, dashboard_every=2, json=True, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(
+            set(report['endpoints']),
+            {'update_location', 'get_order_location', 'dashboard', 'dispatch_dashboard'},
+        )
+        self.assertFalse(any(row['errors'] for row in report['endpoints'].values()))
+        self.assertFalse(User.objects.filter(username__startswith='bench-').exists())
+
+    def test_exported_traces_replay(self):
+        customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        order = Order.objects.create(user=customer, name='Parcel', description='Trace test', status='delivered')
+        start = timezone.now() - timedelta(hours=1)
+        LocationUpdate.objects.bulk_create(
+            LocationUpdate(order=order, latitude=6.5 + i / 1000, longitude=3.3, timestamp=start + timedelta(seconds=i))
+            for i in range(10)
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'traces.jsonl.gz')
+            call_command('export_traces', path, stdout=io.StringIO())
+            out = io.StringIO()
+            call_command('replay_traces', path, speed=1000, copies=3, concurrency=2, json=True, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['fixes'], 30)
+        self.assertEqual(report['rows_added'], 30)
+        self.assertEqual(report['endpoints']['update_location']['errors'], 0)
+
+    def test_async_benchmark_serves_both_handlers(self):
+        # Snapshots cached by earlier tests may share the fixture's order ids
+        cache.clear()
+        out = io.StringIO()
+        call_command('bench_async', concurrency=3, requests=2, threads=2, json=True, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['endpoints']), {'wsgi poll', 'asgi poll'})
+        self.assertFalse(any(row['errors'] for row in report['endpoints'].values()))
+        self.assertEqual(report['asgi']['requests'], 6)
+
+
+# A long interval keeps the background flusher out of the test transaction
+@override_settings(LOCATION_WRITE_BEHIND=True, LOCATION_FLUSH_INTERVAL=3600, LOCATION_FLUSH_SIZE=10000)
+class WriteBehindTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        cls.rider = create_rider()
+        cls.orders = [
+            Order.objects.create(user=cls.customer, name=f'Parcel {i}', description='Write-behind test',
+                                 assigned_dispatch=cls.rider)
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.rider)
+
+    def tearDown(self):
+        location_buffer.flush()
+
+    def post_fix(self, order, latitude):
+        return self.client.post(
+            f'/api/update-location/{order.id}/',
+            json.dumps({'latitude': latitude, 'longitude': 3.3}),
+            content_type='application/json',
+        )
+
+    def test_fixes_are_coalesced(self):
+        # Session, user and order lookups per fix, no writes
+        with self.assertNumQueries(60):
+            for i in range(10):
+                for order in self.orders:
+                    self.post_fix(order, 6.0 + i / 100)
+        self.assertEqual(LocationUpdate.objects.count(), 0)
+
+        self.client.force_login(self.customer)
+        response = self.client.get(f'/api/get-location/{self.orders[0].id}/')
+        self.assertEqual(response.json()['current']['latitude'], 6.09)
+
+        # Load orders, then insert history, update orders and move their
+        # rider in a savepoint
+        with self.assertNumQueries(6):
+            self.assertEqual(location_buffer.flush(), 20)
+        self.assertEqual(LocationUpdate.objects.count(), 20)
+        self.orders[1].refresh_from_db()
+        self.assertEqual(float(self.orders[1].current_latitude), 6.09)
+
+    def test_failed_flush_is_retried_without_duplicates(self):
+        for order in self.orders:
+            self.post_fix(order, 6.0)
+        with mock.patch('main.ingestion._advance_riders', side_effect=RuntimeError('database went away')):
+            with self.assertRaises(RuntimeError):
+                location_buffer.flush()
+        self.assertEqual((LocationUpdate.objects.count(), location_buffer.pending_count()), (0, 2))
+
+        self.assertEqual(location_buffer.flush(), 2)
+        self.assertEqual((LocationUpdate.objects.count(), location_buffer.pending_count()), (2, 0))
+
+
+class PolylineTests(TestCase):
+
+    def test_reference_encoding(self):
+        # Example from the encoded polyline format documentation
+        points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+        encoded = encode_polyline(points, precision=5)
+        self.assertEqual(encoded, '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(decode_polyline(encoded, precision=5), points)
+
+    def test_values_round_trip(self):
+        values = [1765454400, 1765454403, 1765454401, 1765454460]
+        self.assertEqual(decode_values(encode_values(values)), values)
+
+    def test_simplify_drops_collinear_points(self):
+        line = [(6.5 + i * 0.0001, 3.3, i) for i in range(100)]
+        self.assertEqual(simplify(line, 1.0), [line[0], line[-1]])
+        corner = line + [(line[-1][0], 3.3 + i * 0.0001, 100 + i) for i in range(1, 50)]
+        self.assertEqual(len(simplify(corner, 1.0)), 3)
+
+
+class OrderSnapshotTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        cls.other = User.objects.create_user('other', 'other@example.com', 'pw')
+        cls.rider = create_rider()
+        cls.order = Order.objects.create(user=cls.customer, name='Parcel', description='Snapshot test',
+                                         assigned_dispatch=cls.rider)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.customer)
+        self.rider_client = Client()
+        self.rider_client.force_login(self.rider)
+
+    def test_polls_are_served_from_cache(self):
+        self.client.get(f'/api/get-location/{self.order.id}/')
+        with self.assertNumQueries(2):  # session + user, nothing for the order
+            response = self.client.get(f'/api/get-location/{self.order.id}/')
+        self.assertEqual(response.json()['order_id'], self.order.id)
+
+    def test_update_location_refreshes_snapshot(self):
+        self.client.get(f'/api/get-location/{self.order.id}/')
+        self.rider_client.post(
+            f'/api/update-location/{self.order.id}/',
+            json.dumps({'latitude': 6.5, 'longitude': 3.3}),
+            content_type='application/json',
+        )
+        response = self.client.get(f'/api/get-location/{self.order.id}/')
+        self.assertEqual(response.json()['current']['latitude'], 6.5)
+
+    def test_unchanged_poll_is_not_modified(self):
+        url = f'/api/get-location/{self.order.id}/'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(2):  # session + user
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        self.rider_client.post(
+            f'/api/update-location/{self.order.id}/',
+            json.dumps({'latitude': 6.5, 'longitude': 3.3}),
+            content_type='application/json',
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_last_modified_follows_the_order(self):
+        url = f'/api/get-location/{self.order.id}/'
+        fixed_at = timezone.now().replace(microsecond=0) - timedelta(minutes=5)
+        self.rider_client.post(
+            f'/api/update-location/{self.order.id}/',
+            json.dumps({'latitude': 6.5, 'longitude': 3.3, 'timestamp': fixed_at.isoformat()}),
+            content_type='application/json',
+        )
+        self.assertEqual(self.client.get(url)['Last-Modified'], http_date(fixed_at.timestamp()))
+
+        # Delivery changes the order without a new fix
+        Order.objects.filter(id=self.order.id).update(status='dispatched')
+        self.rider_client.post(f'/dispatch/complete/{self.order.id}/')
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(fixed_at.timestamp()))
+        self.assertEqual(response.json()['status'], 'delivered')
+        self.assertGreater(parse_http_date(response['Last-Modified']), fixed_at.timestamp())
+
+    def test_unchanged_track_is_not_modified(self):
+        url = f'/api/track/{self.order.id}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_per_process_cache_is_flagged(self):
+        self.assertEqual([warning.id for warning in check_snapshot_cache(None)], ['main.W001'])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            self.assertEqual(check_snapshot_cache(None), [])
+
+    def test_other_users_cannot_read_snapshot(self):
+        self.client.get(f'/api/get-location/{self.order.id}/')
+        self.client.force_login(self.other)
+        response = self.client.get(f'/api/get-location/{self.order.id}/')
+        self.assertEqual(response.status_code, 404)
+
+
+class PerformanceMiddlewareTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'pw', is_staff=True)
+
+    def setUp(self):
+        metrics_registry.reset()
+
+    def test_server_timing_counts_queries(self):
+        self.client.force_login(self.customer)
+        response = self.client.get('/dashboard/')
+        timing = response['Server-Timing']
+        self.assertIn('desc="4 queries"', timing)
+        for metric in ('db;dur=', 'view;dur=', 'tpl;dur=', 'total;dur='):
+            self.assertIn(metric, timing)
+
+    def test_metrics_are_staff_only(self):
+        self.client.force_login(self.customer)
+        self.client.get('/dashboard/')
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+
+        self.client.force_login(self.staff)
+        endpoints = self.client.get('/metrics/').json()['endpoints']
+        self.assertEqual(endpoints['dashboard']['requests'], 1)
+        self.assertEqual(endpoints['dashboard']['mean_queries'], 4)
+
+    def test_slow_requests_stay_valid_json(self):
+        metrics_registry.observe('slow', 12000.0, 0.0, 1, 0)
+        self.client.force_login(self.staff)
+        # A standard parser, which rejects the Infinity token
+        slow = json.loads(self.client.get('/metrics/').content, parse_constant=self.fail)['endpoints']['slow']
+        self.assertEqual((slow['p50_ms'], slow['p99_ms']), (5000, 5000))
+        self.assertEqual(slow['buckets']['+Inf'], 1)
+
+
+class RetentionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        cls.order = Order.objects.create(user=cls.customer, name='Parcel', description='Retention test', status='delivered')
+        now = timezone.now()
+        LocationUpdate.objects.bulk_create(
+            LocationUpdate(order=cls.order, latitude=6.5 + i / 1000, longitude=3.3,
+                           timestamp=now - timedelta(days=40, minutes=-i))
+            for i in range(7)
+        )
+        LocationUpdate.objects.create(order=cls.order, latitude=6.6, longitude=3.3, timestamp=now)
+
+    def test_command_archives_old_fixes_in_batches(self):
+        out = io.StringIO()
+        call_command('prune_locations', '--batch-size', '3', stdout=out)
+        self.assertIn('Archived 7 fixes from 1 orders and deleted 7 rows', out.getvalue())
+        self.assertEqual(LocationUpdate.objects.filter(order=self.order).count(), 1)
+        self.assertEqual(self.order.compressed_track.raw_point_count, 7)
+
+    def test_late_fixes_are_folded_in(self):
+        cutoff = retention_cutoff()
+        self.assertEqual(archive_order(self.order, cutoff, batch_size=3), (7, 7))
+        # A device uploads a fix from before everything already archived
+        LocationUpdate.objects.create(order=self.order, latitude=6.4, longitude=3.3,
+                                      timestamp=timezone.now() - timedelta(days=41))
+        self.assertEqual(archive_order(self.order, cutoff, batch_size=3), (1, 1))
+        track = CompressedTrack.objects.get(order=self.order)
+        self.assertEqual(track.raw_point_count, 8)
+        self.assertEqual(decode_polyline(track.points)[0], (6.4, 3.3))
+
+    def test_folding_never_simplifies_the_track_again(self):
+        rows = list(
+            LocationUpdate.objects.filter(order=self.order).order_by('timestamp')
+            .values_list('id', 'latitude', 'longitude', 'timestamp')
+        )
+        first = fold_into_track(self.order, rows[:4], 5.0)
+        kept = list(zip(decode_polyline(first.points), decode_values(first.times)))
+        second = fold_into_track(self.order, rows[4:], 5.0)
+        # The new segment is simplified on its own, starting from the track's last point
+        segment = simplify([(*kept[-1][0], kept[-1][1])] + [
+            (float(lat), float(lng), int(ts.timestamp())) for _, lat, lng, ts in rows[4:]
+        ], 5.0)
+        self.assertEqual(
+            list(zip(decode_polyline(second.points), decode_values(second.times))),
+            kept + [((lat, lng), ts) for lat, lng, ts in segment[1:]],
+        )
+        self.assertEqual(second.archived_until, rows[-1][3])
+
+    def test_interrupted_run_keeps_unarchived_rows(self):
+        cutoff = retention_cutoff()
+        with mock.patch('main.retention.fold_into_track', side_effect=[mock.DEFAULT, RuntimeError('killed')],
+                        wraps=fold_into_track):
+            with self.assertRaises(RuntimeError):
+                archive_order(self.order, cutoff, batch_size=3)
+        # The first batch went into the track, the rest is still stored raw
+        self.assertEqual(CompressedTrack.objects.get(order=self.order).raw_point_count, 3)
+        self.assertEqual(archive_order(self.order, cutoff, batch_size=3), (4, 4))
+        self.assertEqual(CompressedTrack.objects.get(order=self.order).raw_point_count, 7)
+
+
+class AutoDispatchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        now = timezone.now()
+        cls.riders = []
+        for i, (lat, lng) in enumerate([(6.50, 3.30), (6.60, 3.30), (6.70, 3.30)]):
+            rider = User.objects.create_user(f'rider{i}', f'rider{i}@example.com', 'pw')
+            rider.profile.user_type = 'dispatch'
+            rider.profile.last_latitude = lat
+            rider.profile.last_longitude = lng
+            rider.profile.last_location_update = now
+            rider.profile.save()
+            cls.riders.append(rider)
+        cls.riders[2].profile.is_available = False
+        cls.riders[2].profile.save()
+        cls.orders = [
+            Order.objects.create(user=cls.customer, name=f'Order {i}', description='Dispatch test',
+                                 pickup_latitude=lat, pickup_longitude=3.30)
+            for i, lat in enumerate([6.601, 6.501, 6.701])
+        ]
+
+    def test_match_prefers_shorter_pairs(self):
+        orders = [(1, 0.0, 0.0), (2, 0.0, 0.02)]
+        riders = [(10, 0.0, 0.019, 1), (11, 0.0, 0.05, 1)]
+        assignments, _ = match(orders, riders, max_distance_km=50)
+        self.assertEqual(assignments, {2: 10, 1: 11})
+
+    def test_tick_assigns_nearest_available_riders(self):
+        result = dispatch_tick()
+        self.assertEqual(result['assigned'], 2)
+        assigned = dict(Order.objects.values_list('id', 'assigned_dispatch_id'))
+        self.assertEqual(assigned[self.orders[0].id], self.riders[1].id)
+        self.assertEqual(assigned[self.orders[1].id], self.riders[0].id)
+        self.assertIsNone(assigned[self.orders[2].id])
+        # Both riders are now busy
+        self.assertEqual(dispatch_tick()['assigned'], 0)
+
+
+class ProgressTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        cls.rider = create_rider()
+        cls.order = Order.objects.create(
+            user=cls.customer, name='Parcel', description='ETA test', status='dispatched',
+            assigned_dispatch=cls.rider, delivery_latitude=6.6, delivery_longitude=3.3,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.rider)
+
+    def post_fix(self, latitude, timestamp):
+        self.client.post(
+            f'/api/update-location/{self.order.id}/',
+            json.dumps({'latitude': latitude, 'longitude': 3.3, 'timestamp': timestamp.isoformat()}),
+            content_type='application/json',
+        )
+
+    def test_haversine(self):
+        # One degree of latitude is about 111.2 km
+        self.assertAlmostEqual(haversine_m([6.0], [3.3], [7.0], [3.3])[0], 111195, delta=5)
+
+    def test_speed_and_eta_follow_fixes(self):
+        start = timezone.now() - timedelta(seconds=60)
+        # 0.001 degrees of latitude (~111 m) every 10 s: ~40 km/h
+        for i in range(7):
+            self.post_fix(6.5 + i * 0.001, start + timedelta(seconds=10 * i))
+
+        self.client.force_login(self.customer)
+        progress = self.client.get(f'/api/get-location/{self.order.id}/').json()['progress']
+        self.assertAlmostEqual(progress['remaining_km'], 10.45, delta=0.02)
+        self.assertAlmostEqual(progress['speed_kmh'], 40.0, delta=0.2)
+        self.assertAlmostEqual(progress['eta_seconds'], 940, delta=10)
+
+    def test_state_is_seeded_from_history(self):
+        start = timezone.now() - timedelta(seconds=60)
+        for i in range(3):
+            self.post_fix(6.5 + i * 0.001, start + timedelta(seconds=10 * i))
+        cache.clear()
+        self.post_fix(6.503, start + timedelta(seconds=30))
+
+        self.client.force_login(self.customer)
+        progress = self.client.get(f'/api/get-location/{self.order.id}/').json()['progress']
+        self.assertAlmostEqual(progress['speed_kmh'], 40.0, delta=0.2)
+
+
+class ReportIntervalTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        cls.rider = create_rider()
+        cls.order = Order.objects.create(
+            user=cls.customer, name='Parcel', description='Report interval test', status='dispatched',
+            assigned_dispatch=cls.rider,
+            pickup_latitude=6.5, pickup_longitude=3.3, delivery_latitude=6.6, delivery_longitude=3.3,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def at(self, latitude, speed_kmh):
+        self.order.current_latitude = Decimal(str(latitude))
+        self.order.current_longitude = Decimal('3.3')
+        self.order.progress = {'speed_kmh': speed_kmh} if speed_kmh is not None else None
+        return self.order
+
+    def test_dense_near_stops_sparse_when_far_or_stopped(self):
+        # 36 km/h is 10 m/s. 5.5 km out: 500 m spacing, capped at 60 s
+        self.assertEqual(report_interval(self.at(6.55, 36), load=1), 50)
+        # 1.1 km from the drop-off: 110 m spacing
+        self.assertEqual(report_interval(self.at(6.59, 36), load=1), 11)
+        # At the door: the 5 s floor
+        self.assertEqual(report_interval(self.at(6.5999, 36), load=1), 5)
+        self.assertEqual(report_interval(self.at(6.5999, 0), load=1), 60)
+        self.assertEqual(report_interval(self.at(6.5999, None), load=1), 60)
+        # Twice the target load doubles intervals, floor included
+        self.assertEqual(report_interval(self.at(6.59, 36), load=2), 22)
+        self.assertEqual(report_interval(self.at(6.5999, 36), load=2), 10)
+
+    def test_ingest_rate_window(self):
+        rate = IngestRate(window=10)
+        rate.observe(50, now=100)
+        rate.observe(50, now=105)
+        self.assertEqual(rate.per_second(now=105), 10)
+        self.assertEqual(rate.per_second(now=112), 5)
+        self.assertEqual(rate.per_second(now=120), 0)
+
+    def test_update_location_returns_interval(self):
+        self.client.force_login(self.rider)
+        response = self.client.post(
+            f'/api/update-location/{self.order.id}/',
+            json.dumps({'latitude': 6.55, 'longitude': 3.3}), content_type='application/json',
+        )
+        # A first fix has no speed yet
+        self.assertEqual(response.json()['next_report_seconds'], 60)
+
+
+class FleetSnapshotTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('ops', 'ops@example.com', 'pw', is_staff=True)
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        cls.rider = create_rider()
+        cls.lagos, cls.abuja, cls.waiting = (
+            Order.objects.create(
+                user=cls.customer, name=name, description='Fleet test', status=status,
+                assigned_dispatch=cls.rider if status == 'dispatched' else None,
+                current_latitude=lat, current_longitude=lng,
+            )
+            for name, status, lat, lng in (
+                ('Lagos', 'dispatched', Decimal('6.5'), Decimal('3.3')),
+                ('Abuja', 'dispatched', Decimal('9.05'), Decimal('7.49')),
+                ('Waiting', 'pending', Decimal('6.5'), Decimal('3.3')),
+            )
+        )
+
+    def setUp(self):
+        fleet.refresh()
+        self.client.force_login(self.staff)
+
+    def test_columns_and_bbox(self):
+        orders = self.client.get('/api/fleet/').json()['orders']
+        self.assertEqual(orders['order_id'], [self.lagos.id, self.abuja.id])
+        self.assertEqual(orders['latitude'], [6.5, 9.05])
+        self.assertEqual(orders['rider_id'], [self.rider.id, self.rider.id])
+
+        response = self.client.get('/api/fleet/', {'bbox': '3,6,4,7'})
+        self.assertEqual(response.json()['orders']['order_id'], [self.lagos.id])
+        self.assertEqual(self.client.get('/api/fleet/', {'bbox': '4,6,3,7'}).status_code, 400)
+
+    def test_fixes_update_the_snapshot_without_queries(self):
+        etag = self.client.get('/api/fleet/')['ETag']
+        rider = Client()
+        rider.force_login(self.rider)
+        rider.post(
+            f'/api/update-location/{self.abuja.id}/',
+            json.dumps({'latitude': 9.06, 'longitude': 7.5}), content_type='application/json',
+        )
+        # Session and user only
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/fleet/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json()['orders']['latitude'], [6.5, 9.06])
+        response = self.client.get('/api/fleet/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_untracked_changes_keep_the_payload(self):
+        etag, body = fleet.payload()
+        self.lagos.description = 'Edited'
+        self.lagos.save()
+        fleet.refresh()
+        self.assertIs(fleet.payload()[1], body)
+
+        self.lagos.current_latitude = Decimal('6.51')
+        self.lagos.save()
+        self.assertNotEqual(fleet.payload()[0], etag)
+
+    def test_staff_only(self):
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get('/api/fleet/').status_code, 403)
+
+
+class GeofenceTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        cls.rider = create_rider()
+        cls.order = Order.objects.create(
+            user=cls.customer, name='Parcel', description='Geofence test', status='dispatched',
+            assigned_dispatch=cls.rider, pickup_latitude=6.5, pickup_longitude=3.3,
+            delivery_latitude=6.6, delivery_longitude=3.3,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.events = []
+        receiver = lambda sender, events, **kwargs: self.events.extend(events)
+        geofence_crossed.connect(receiver, weak=False)
+        self.addCleanup(geofence_crossed.disconnect, receiver)
+        self.start = timezone.now() - timedelta(minutes=10)
+        self.client.force_login(self.rider)
+
+    def post_fixes(self, latitudes):
+        fixes = [
+            {'order_id': self.order.id, 'latitude': latitude, 'longitude': 3.3,
+             'timestamp': (self.start + timedelta(seconds=20 * i)).isoformat()}
+            for i, latitude in enumerate(latitudes)
+        ]
+        self.client.post('/api/update-location/batch/', json.dumps({'fixes': fixes}), content_type='application/json')
+
+    def test_arrival_and_departure(self):
+        # 0.0006 degrees is ~67 m: inside the pickup fence; 0.0008 (~89 m)
+        # is outside it but within the exit margin, so it is not a departure.
+        # Session and user, then only ingestion's own queries: five, one of
+        # them seeding the ETA state, inside a savepoint since the test
+        # already holds a transaction
+        with self.assertNumQueries(9):
+            self.post_fixes([6.499, 6.4994, 6.4992, 6.5, 6.5008, 6.51])
+        self.assertEqual(
+            [(event.fence, event.kind) for event in self.events],
+            [('pickup', 'arrival'), ('pickup', 'departure')],
+        )
+        # Fixes already seen do not fire again
+        self.post_fixes([6.499, 6.4994])
+        self.assertEqual(len(self.events), 2)
+
+    @override_settings(GEOFENCE_AUTO_DELIVER=True, GEOFENCE_DWELL_SECONDS=30)
+    def test_dwelling_at_drop_off_delivers(self):
+        self.post_fixes([6.6001, 6.6002])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'dispatched')
+
+        self.post_fixes([6.6001, 6.6002, 6.6001])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'delivered')
+        self.assertEqual(UserProfile.objects.get(user=self.rider).total_deliveries, 1)
+
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get(f'/api/get-location/{self.order.id}/').json()['status'], 'delivered')
+
+
+class BinaryFixesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        cls.rider = create_rider()
+        cls.order = Order.objects.create(user=cls.customer, name='Parcel', description='Wire format test',
+                                         assigned_dispatch=cls.rider)
+
+    def setUp(self):
+        self.client.force_login(self.rider)
+        start = timezone.now().replace(microsecond=0) - timedelta(hours=3)
+        # The jump after the tenth fix does not fit a record and opens a new frame
+        self.points = [(start + timedelta(seconds=3 * i), 6.5 + i * 0.0001, 3.3 - i * 0.0001) for i in range(10)]
+        self.points.append((start + timedelta(hours=2), 6.6, 3.4))
+
+    def test_round_trip(self):
+        body = encode_fixes(self.order.id, self.points)
+        self.assertEqual(len(body), 2 * 28 + 11 * 6)
+        fixes = decode_fixes(body)
+        self.assertEqual(
+            [(fix.timestamp, round(fix.latitude, 6), round(fix.longitude, 6)) for fix in fixes],
+            [(ts, round(lat, 6), round(lng, 6)) for ts, lat, lng in self.points],
+        )
+        with self.assertRaises(ValueError):
+            decode_fixes(body[:-1])
+        with self.assertRaises(ValueError):
+            decode_fixes(body, order_id=self.order.id + 1)
+
+    def test_batch_upload(self):
+        body = encode_fixes(self.order.id, self.points) + encode_fixes(self.order.id + 1, self.points[:1])
+        response = self.client.post('/api/update-location/batch/', body, content_type=BINARY_FIXES)
+        self.assertEqual(response.json(), {
+            'success': True, 'accepted': 11,
+            'errors': [{'index': 11, 'order_id': self.order.id + 1, 'error': 'Order not found'}],
+            'next_report_seconds': {str(self.order.id): 60},
+        })
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.current_latitude, self.order.last_location_update), (Decimal('6.6'), self.points[-1][0]))
+        self.assertEqual(LocationUpdate.objects.filter(order=self.order).count(), 11)
+
+        response = self.client.post(f'/api/update-location/{self.order.id}/', b'FX', content_type=BINARY_FIXES)
+        self.assertEqual(response.status_code, 400)
+
+    def test_replayed_uploads_are_recorded_once(self):
+        device = 'a1' * 16
+        body = encode_fixes(self.order.id, self.points[:6], device=device, seq=100)
+        for _ in range(2):
+            response = self.client.post(f'/api/update-location/{self.order.id}/', body, content_type=BINARY_FIXES)
+            self.assertEqual(response.status_code, 200)
+        # A retry that overlaps the acknowledged fixes
+        body = encode_fixes(self.order.id, self.points[4:], device=device, seq=104)
+        self.client.post(f'/api/update-location/{self.order.id}/', body, content_type=BINARY_FIXES)
+        self.assertEqual(
+            list(LocationUpdate.objects.filter(order=self.order).order_by('seq').values_list('seq', flat=True)),
+            list(range(100, 111)),
+        )
+
+        fix = {'order_id': self.order.id, 'latitude': 6.7, 'longitude': 3.3, 'seq': 1}
+        for _ in range(2):
+            self.client.post('/api/update-location/batch/', json.dumps({'device': 'phone', 'fixes': [fix]}),
+                             content_type='application/json')
+        self.assertEqual(LocationUpdate.objects.filter(device='phone').count(), 1)
+
+    def test_ids_beyond_bigint_are_rejected(self):
+        fix = {'order_id': self.order.id, 'latitude': 6.7, 'longitude': 3.3}
+        response = self.client.post('/api/update-location/batch/', json.dumps({'device': 'phone', 'fixes': [
+            {**fix, 'seq': 2 ** 63}, {**fix, 'order_id': 10 ** 30}, {**fix, 'seq': 2 ** 63 - 1},
+        ]}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [result.get('error') for result in response.json()['results']],
+            ['Invalid seq', 'Invalid order_id', None],
+        )
+        self.assertEqual(LocationUpdate.objects.get(order=self.order).seq, 2 ** 63 - 1)
+
+        # The frame's second fix would be numbered 2**63
+        body = encode_fixes(self.order.id, self.points[:2], device='a1' * 16, seq=2 ** 63 - 1)
+        response = self.client.post(f'/api/update-location/{self.order.id}/', body, content_type=BINARY_FIXES)
+        self.assertEqual(response.status_code, 400)
+
+
+class RoleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'pw')
+        cls.rider = User.objects.create_user('rider', 'rider@example.com', 'pw')
+        cls.rider.profile.user_type = 'dispatch'
+        cls.rider.profile.save()
+
+    def test_profile_is_loaded_with_user(self):
+        self.client.force_login(self.rider)
+        with self.assertNumQueries(2):  # session + user joined to profile
+            response = self.client.get('/')
+        self.assertRedirects(response, '/dispatch/', fetch_redirect_response=False)
+
+    def test_login_caches_role(self):
+        self.client.post('/login/', {'username': 'rider', 'password': 'pw'})
+        self.assertEqual(self.client.session['user_role'], 'dispatch')
+
+    def test_role_follows_profile_changes(self):
+        self.client.post('/login/', {'username': 'rider', 'password': 'pw'})
+        profile = UserProfile.objects.get(user=self.rider)
+        profile.user_type = 'user'
+        profile.save()
+        response = self.client.get('/dispatch/')
+        self.assertRedirects(response, '/dashboard/', fetch_redirect_response=False)
+        self.assertEqual(self.client.session['user_role'], 'user')
+
+    def test_sessions_from_model_backend_stay_logged_in(self):
+        self.client.force_login(self.rider, backend='django.contrib.auth.backends.ModelBackend')
+        response = self.client.get('/')
+        self.assertRedirects(response, '/dispatch/', fetch_redirect_response=False)
+
+    def test_dispatch_views_reject_customers(self):
+        self.client.force_login(self.customer)
+        response = self.client.get('/dispatch/')
+        self.assertRedirects(response, '/dashboard/', fetch_redirect_response=False)
+        response = self.client.get('/api/nearby-orders/')
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(SimpleTestCase):
+
+    def serve(self, view, write=False, cookies=None):
+        """Run view's routing through the middleware; returns (read alias, response)"""
+        router = ReplicaRouter()
+        seen = []
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            seen.append(router.db_for_read(Order))
+            if write:
+                router.db_for_write(LocationUpdate)
+                seen.append(router.db_for_read(Order))
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies or {})
+        response = middleware(request)
+        return seen, response
+
+    def test_read_only_views_use_a_replica(self):
+        seen, response = self.serve(replica_reads(lambda request: None))
+        self.assertEqual(seen, ['replica'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+        seen, _ = self.serve(lambda request: None)
+        self.assertEqual(seen, [None])
+        # Outside a request everything stays on the primary
+        self.assertIsNone(ReplicaRouter().db_for_read(Order))
+
+    def test_cache_rebuilds_read_from_the_primary(self):
+        router = ReplicaRouter()
+        view = replica_reads(lambda request: None)
+        seen = []
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            with primary_reads():
+                seen.append(router.db_for_read(Order))
+            seen.append(router.db_for_read(Order))
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        middleware(RequestFactory().get('/'))
+        self.assertEqual(seen, [None, 'replica'])
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        view = replica_reads(lambda request: None)
+        seen, response = self.serve(view, write=True)
+        self.assertEqual(seen, ['replica', None])
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        seen, _ = self.serve(view, cookies={PIN_COOKIE: response.cookies[PIN_COOKIE].value})
+        self.assertEqual(seen, [None])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaDatabaseTests(TestCase):
+    databases = {'default', 'replica'}
+
+    def aliases_used(self, view, cookies=None):
+        """Run view through the middleware; returns the aliases its queries went to"""
+        used = []
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            with CaptureQueriesContext(connections['default']) as primary:
+                with CaptureQueriesContext(connections['replica']) as replica:
+                    view(request)
+            used.extend(alias for alias, queries in (('default', primary), ('replica', replica)) if len(queries))
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies or {})
+        middleware(request)
+        return used
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(self.aliases_used(replica_reads(lambda request: list(Order.objects.all()))), ['replica'])
+        self.assertEqual(self.aliases_used(lambda request: list(Order.objects.all())), ['default'])
+
+    def test_primary_reads_and_pinned_clients_use_the_primary(self):
+        def rebuild(request):
+            with primary_reads():
+                list(Order.objects.all())
+
+        self.assertEqual(self.aliases_used(replica_reads(rebuild)), ['default'])
+        view = replica_reads(lambda request: list(Order.objects.all()))
+        self.assertEqual(self.aliases_used(view, cookies={PIN_COOKIE: '1'}), ['default'])
+
+    def test_reads_inside_a_transaction_use_the_primary(self):
+        def view(request):
+            with transaction.atomic():
+                list(Order.objects.all())
+
+        self.assertEqual(self.aliases_used(replica_reads(view)), ['default'])
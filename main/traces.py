@@ -0,0 +1,89 @@
+import gzip
+import json
+
+from .models import Order, LocationUpdate
+from .polyline import encode_polyline, encode_values, decode_polyline, decode_values
+
+# Rider trace files for export_traces / replay_traces.
+#
+# A trace file is gzipped JSON Lines. The first line is a header and every
+# following line is one order's raw history:
+#
+#   {"format": "rider-traces", "version": 1}
+#   {"order_id": 17, "rider_id": 4, "start": 1760000000, "count": 312,
+#    "points": "<polyline6>", "times": "<delta-coded seconds since start>"}
+#
+# Points and times use the codec in main.polyline, so a typical trace costs
+# a few bytes per fix.
+
+FORMAT = 'rider-traces'
+VERSION = 1
+
+
+def export_traces(path, orders):
+    """Write the raw LocationUpdate history of each order; returns (traces, fixes)"""
+    traces = fixes = 0
+    with gzip.open(path, 'wt', encoding='utf-8') as out:
+        out.write(json.dumps({'format': FORMAT, 'version': VERSION}) + '\n')
+        for order in orders.iterator():
+            rows = list(
+                LocationUpdate.objects
+                .filter(order=order)
+                .order_by('timestamp', 'id')
+                .values_list('latitude', 'longitude', 'timestamp')
+            )
+            if len(rows) < 2:
+                continue
+            start = int(rows[0][2].timestamp())
+            out.write(json.dumps({
+                'order_id': order.id,
+                'rider_id': order.assigned_dispatch_id,
+                'start': start,
+                'count': len(rows),
+                'points': encode_polyline((lat, lng) for lat, lng, _ in rows),
+                'times': encode_values(int(ts.timestamp()) - start for _, _, ts in rows),
+            }, separators=(',', ':')) + '\n')
+            traces += 1
+            fixes += len(rows)
+    return traces, fixes
+
+
+def load_traces(path):
+    """
+    Read a trace file into a list of dicts with start and a list of
+    (seconds_since_start, latitude, longitude) fixes. Raises ValueError if
+    the file is not a trace file.
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as src:
+        try:
+            header = json.loads(src.readline())
+        except (OSError, json.JSONDecodeError):  # OSError: not gzipped
+            raise ValueError('Not a trace file')
+        if not isinstance(header, dict) or header.get('format') != FORMAT:
+            raise ValueError('Not a trace file')
+        if header.get('version') != VERSION:
+            raise ValueError(f"Unsupported trace file version {header.get('version')}")
+
+        traces = []
+        for line in src:
+            record = json.loads(line)
+            points = decode_polyline(record['points'])
+            times = decode_values(record['times'])
+            traces.append({
+                'order_id': record['order_id'],
+                'rider_id': record.get('rider_id'),
+                'start': record['start'],
+                'fixes': [(offset, lat, lng) for offset, (lat, lng) in zip(times, points)],
+            })
+    return traces
+
+
+def exportable_orders(order_ids=None, since=None, limit=None):
+    orders = Order.objects.order_by('id')
+    if order_ids:
+        orders = orders.filter(id__in=order_ids)
+    if since is not None:
+        orders = orders.filter(last_location_update__gte=since)
+    if limit:
+        orders = orders[:limit]
+    return orders
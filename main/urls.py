@@ -1,8 +1,10 @@
 from django.urls import path
 from .views import (
     index, login_view, register_view, dashboard, logout_view, 
-    create_order, track_order, update_location, get_order_location,
-    dispatch_dashboard, accept_order, dispatch_tracking, complete_delivery
+    create_order, track_order, update_location, batch_update_location, get_order_location,
+    stream_order_location, get_order_track,
+    dispatch_dashboard, accept_order, dispatch_tracking, complete_delivery, nearby_orders,
+    metrics, fleet_snapshot
 )
 
 urlpatterns = [
@@ -21,6 +23,12 @@ urlpatterns = [
     
     # API endpoints
     path('api/update-location/<int:order_id>/', update_location, name='update_location'),
+    path('api/update-location/batch/', batch_update_location, name='batch_update_location'),
     path('api/get-location/<int:order_id>/', get_order_location, name='get_order_location'),
+    path('api/stream-location/<int:order_id>/', stream_order_location, name='stream_order_location'),
+    path('api/track/<int:order_id>/', get_order_track, name='get_order_track'),
+    path('api/nearby-orders/', nearby_orders, name='nearby_orders'),
+    path('api/fleet/', fleet_snapshot, name='fleet_snapshot'),
+    path('metrics/', metrics, name='metrics'),
     path('logout/', logout_view, name='logout'),
 ]
\ No newline at end of file
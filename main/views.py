@@ -4,30 +4,59 @@ from .models import Order, Delivery, UserProfile, LocationUpdate
 from django.contrib.auth import login as auth_login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
-from django.views.decorators.http import require_http_methods
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_http_methods, condition
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.views.decorators.csrf import csrf_exempt
+from django.db.models import Count, Q
 from django.utils import timezone
+import asyncio
 import json
 
+from asgiref.sync import sync_to_async
+
+from .assignment import claim_order
+from .auth import redirect_home, request_rider, role_required
+from .broker import broker, encode_event
+from .compaction import encode_raw_history, track_payload
+from .fleet import fleet
+from .ingestion import parse_fix, aingest_fixes, apply_buffered_position
+from .metrics import registry as metrics_registry
+from .pagination import keyset_paginate
+from .rider_stats import record_delivered, today_stats
+from .routing import primary_reads, replica_reads
+from .snapshots import aget_snapshot, refresh_snapshot
+from .spatial import available_orders as available_orders_index
+from .wire import CONTENT_TYPE as BINARY_FIXES, decode_fixes
+
 # Create your views here.
 
+# Upper bound on fixes accepted by one batch_update_location request
+MAX_BATCH_FIXES = 500
+
+# Orders per page on the user dashboard and the rider's assigned list
+ORDERS_PAGE_SIZE = 20
+ASSIGNED_PAGE_SIZE = 10
+
+# Available jobs shown on the dispatch dashboard, and the most nearby_orders returns
+AVAILABLE_ORDERS_LIMIT = 20
+MAX_NEARBY_ORDERS = 100
+
+# Seconds between keep-alive comments on an idle location stream
+STREAM_KEEPALIVE = 15
+
 def index(request):
     """Landing page for the tracking application"""
     if request.user.is_authenticated:
-        # Redirect based on user type
-        if hasattr(request.user, 'profile') and request.user.profile.user_type == 'dispatch':
-            return redirect('dispatch_dashboard')
-        return redirect('dashboard')
+        return redirect_home(request)
     return render(request, 'index.html')
 
 def login_view(request):
     """Login page for users"""
     if request.user.is_authenticated:
-        # Check user type and redirect accordingly
-        if hasattr(request.user, 'profile') and request.user.profile.user_type == 'dispatch':
-            return redirect('dispatch_dashboard')
-        return redirect('dashboard')
+        return redirect_home(request)
     
     if request.method == 'POST':
         username = request.POST.get('username')
@@ -36,11 +65,7 @@ def login_view(request):
         if user is not None:
             auth_login(request, user)
             messages.success(request, f'Welcome back, {user.username}!')
-            
-            # Redirect based on user type
-            if hasattr(user, 'profile') and user.profile.user_type == 'dispatch':
-                return redirect('dispatch_dashboard')
-            return redirect('dashboard')
+            return redirect_home(request)
         else:
             messages.error(request, 'Invalid username or password.')
             return redirect('login')
@@ -49,10 +74,7 @@ def login_view(request):
 def register_view(request):
     """Registration page for new users"""
     if request.user.is_authenticated:
-        # Check user type and redirect accordingly
-        if hasattr(request.user, 'profile') and request.user.profile.user_type == 'dispatch':
-            return redirect('dispatch_dashboard')
-        return redirect('dashboard')
+        return redirect_home(request)
     
     if request.method == 'POST':
         username = request.POST.get('username')
@@ -97,26 +119,26 @@ def register_view(request):
         
         auth_login(request, user)
         messages.success(request, f'Welcome, {user.username}! Your account has been created.')
-        
-        # Redirect based on user type
-        if user_type == 'dispatch':
-            return redirect('dispatch_dashboard')
-        return redirect('dashboard')
+        return redirect_home(request)
     
     return render(request, 'register.html')
 
 @login_required(login_url='login')
+@replica_reads
 def dashboard(request):
     """Dashboard page for logged-in users"""
-    orders = Order.objects.filter(user=request.user).order_by('-date_created')
-    stats = {
-        'total_orders': orders.count(),
-        'pending': orders.filter(status='pending').count(),
-        'dispatched': orders.filter(status='dispatched').count(),
-        'delivered': orders.filter(status='delivered').count(),
-    }
+    orders = Order.objects.filter(user=request.user)
+    stats = orders.aggregate(
+        total_orders=Count('id'),
+        pending=Count('id', filter=Q(status='pending')),
+        dispatched=Count('id', filter=Q(status='dispatched')),
+        delivered=Count('id', filter=Q(status='delivered')),
+    )
+    page, next_cursor = keyset_paginate(orders, request.GET.get('cursor'), ORDERS_PAGE_SIZE)
     context = {
-        'orders': orders,
+        'orders': page,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
         'stats': stats,
     }
     return render(request, 'dashboard.html', context)
@@ -167,168 +189,382 @@ def create_order(request):
     return render(request, 'create_order.html')
 
 @login_required(login_url='login')
+@replica_reads
 def track_order(request, order_id):
     """Track an order with real-time location on map"""
     try:
-        order = Order.objects.get(id=order_id, user=request.user)
+        order = Order.objects.select_related('compressed_track').get(id=order_id, user=request.user)
     except Order.DoesNotExist:
         messages.error(request, 'Order not found.')
         return redirect('dashboard')
     
-    # Get location history
-    location_history = LocationUpdate.objects.filter(order=order)[:50]  # Last 50 updates
+    apply_buffered_position(order)
+    
+    # Get location history: finished orders keep it as one compressed track
+    track = order.compressed_track if hasattr(order, 'compressed_track') else None
+    if track is not None:
+        location_history = track.history()[:50]
+    else:
+        location_history = LocationUpdate.objects.filter(order=order)[:50]  # Last 50 updates
     
     context = {
         'order': order,
         'location_history': location_history,
+        'track': track,
     }
     return render(request, 'track_order.html', context)
 
 @csrf_exempt  # In production, use proper CSRF handling
 @require_http_methods(["POST"])
-def update_location(request, order_id):
+async def update_location(request, order_id):
     """API endpoint to update delivery location (for delivery personnel/system)"""
+    rider = await sync_to_async(request_rider)(request)
+    if rider is None:
+        return JsonResponse({'success': False, 'error': 'Access denied'}, status=403)
+
     try:
-        data = json.loads(request.body)
-        latitude = data.get('latitude')
-        longitude = data.get('longitude')
-        notes = data.get('notes', '')
-        
-        if not latitude or not longitude:
-            return JsonResponse({'success': False, 'error': 'Missing coordinates'}, status=400)
-        
-        order = Order.objects.get(id=order_id)
-        
-        # Update current location
-        order.current_latitude = latitude
-        order.current_longitude = longitude
-        order.last_location_update = timezone.now()
-        order.save()
-        
-        # Create location history entry
-        LocationUpdate.objects.create(
-            order=order,
-            latitude=latitude,
-            longitude=longitude,
-            notes=notes
-        )
-        
+        if request.content_type == BINARY_FIXES:
+            # Binary frames may carry several queued fixes for this order
+            fixes = decode_fixes(request.body, order_id=order_id, limit=MAX_BATCH_FIXES)
+            if not fixes:
+                raise ValueError('Missing fixes')
+        else:
+            fixes = [parse_fix(json.loads(request.body), order_id=order_id)]
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    try:
+        result = (await aingest_fixes(fixes, rider_id=rider.id))[-1]
+        if not result['success']:
+            return JsonResponse({'success': False, 'error': result['error']}, status=404)
+
         return JsonResponse({
             'success': True,
             'message': 'Location updated successfully',
-            'last_update': order.last_location_update.isoformat()
+            'last_update': result['timestamp'],
+            'next_report_seconds': result['next_report_seconds'],
         })
-        
-    except Order.DoesNotExist:
-        return JsonResponse({'success': False, 'error': 'Order not found'}, status=404)
+
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+@csrf_exempt  # In production, use proper CSRF handling
+@require_http_methods(["POST"])
+async def batch_update_location(request):
+    """API endpoint to record an ordered batch of fixes for one or more orders"""
+    rider = await sync_to_async(request_rider)(request)
+    if rider is None:
+        return JsonResponse({'success': False, 'error': 'Access denied'}, status=403)
+    if request.content_type == BINARY_FIXES:
+        return await _binary_batch_update_location(request, rider)
+
+    try:
+        data = json.loads(request.body)
     except json.JSONDecodeError:
         return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+
+    raw_fixes = data.get('fixes') if isinstance(data, dict) else None
+    if not isinstance(raw_fixes, list) or not raw_fixes:
+        return JsonResponse({'success': False, 'error': 'Missing fixes'}, status=400)
+    if len(raw_fixes) > MAX_BATCH_FIXES:
+        return JsonResponse({'success': False, 'error': f'At most {MAX_BATCH_FIXES} fixes per batch'}, status=400)
+
+    # Validate everything first so bad fixes get a result without touching the DB
+    results = [None] * len(raw_fixes)
+    fixes = []
+    positions = []
+    for index, raw in enumerate(raw_fixes):
+        try:
+            fixes.append(parse_fix(raw, device=data.get('device')))
+            positions.append(index)
+        except ValueError as e:
+            order_id = raw.get('order_id') if isinstance(raw, dict) else None
+            results[index] = {'success': False, 'order_id': order_id, 'error': str(e)}
+
+    try:
+        if fixes:
+            for index, result in zip(positions, await aingest_fixes(fixes, rider_id=rider.id)):
+                results[index] = result
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+    return JsonResponse({
+        'success': True,
+        'accepted': sum(1 for result in results if result['success']),
+        'results': results,
+    })
+
+async def _binary_batch_update_location(request, rider):
+    """batch_update_location for binary bodies; only failed fixes are listed back"""
+    try:
+        fixes = decode_fixes(request.body, limit=MAX_BATCH_FIXES)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    if not fixes:
+        return JsonResponse({'success': False, 'error': 'Missing fixes'}, status=400)
+
+    try:
+        results = await aingest_fixes(fixes, rider_id=rider.id)
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
+    return JsonResponse({
+        'success': True,
+        'accepted': sum(1 for result in results if result['success']),
+        'errors': [
+            {'index': index, 'order_id': result['order_id'], 'error': result['error']}
+            for index, result in enumerate(results) if not result['success']
+        ],
+        'next_report_seconds': {
+            result['order_id']: result['next_report_seconds'] for result in results if result['success']
+        },
+    })
+
 @login_required(login_url='login')
-def get_order_location(request, order_id):
+@replica_reads
+async def get_order_location(request, order_id):
     """API endpoint to get current order location (for real-time updates)"""
+    # Served from the snapshot cache; the DB is only read to rebuild a missing entry
+    snapshot = await aget_snapshot(order_id)
+    if snapshot is None:
+        # Rebuild from the primary; the cached copy outlives any replica lag
+        with primary_reads():
+            try:
+                order = apply_buffered_position(await Order.objects.aget(id=order_id))
+            except Order.DoesNotExist:
+                return JsonResponse({'success': False, 'error': 'Order not found'}, status=404)
+            snapshot = await sync_to_async(refresh_snapshot)(order)
+    
+    user = await request.auser()
+    if snapshot['user_id'] != user.id:
+        return JsonResponse({'success': False, 'error': 'Order not found'}, status=404)
+    
+    # Unchanged since the client's last poll: 304 without touching the body
+    not_modified = get_conditional_response(
+        request, etag=snapshot['etag'], last_modified=snapshot['last_modified'],
+    )
+    if not_modified is not None:
+        not_modified['Cache-Control'] = 'private, no-cache'
+        return not_modified
+    
+    response = HttpResponse(snapshot['body'], content_type='application/json')
+    response['ETag'] = snapshot['etag']
+    response['Last-Modified'] = http_date(snapshot['last_modified'])
+    # Let browsers keep the body but revalidate on every poll
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _order_track_etag(request, order_id):
+    """Version of an order's track from one narrow query; None lets the view 404"""
+    version = (
+        Order.objects
+        .filter(id=order_id, user=request.user)
+        .values_list('status', 'last_location_update', 'compressed_track__id', 'compressed_track__raw_point_count')
+        .first()
+    )
+    if version is None:
+        return None
+    status, last_update, track_id, raw_points = version
+    return f"track-{status}-{last_update.timestamp() if last_update else 0}-{track_id or 0}-{raw_points or 0}"
+
+@login_required(login_url='login')
+@condition(etag_func=_order_track_etag)
+@replica_reads
+def get_order_track(request, order_id):
+    """API endpoint returning an order's travelled path as encoded polylines"""
     try:
-        order = Order.objects.get(id=order_id, user=request.user)
-        
-        response_data = {
-            'success': True,
-            'order_id': order.id,
-            'status': order.status,
-            'pickup': {
-                'address': order.pickup_address,
-                'latitude': float(order.pickup_latitude) if order.pickup_latitude else None,
-                'longitude': float(order.pickup_longitude) if order.pickup_longitude else None,
-            } if order.pickup_latitude and order.pickup_longitude else None,
-            'delivery': {
-                'address': order.delivery_address,
-                'latitude': float(order.delivery_latitude) if order.delivery_latitude else None,
-                'longitude': float(order.delivery_longitude) if order.delivery_longitude else None,
-            } if order.delivery_latitude and order.delivery_longitude else None,
-            'current': {
-                'latitude': float(order.current_latitude) if order.current_latitude else None,
-                'longitude': float(order.current_longitude) if order.current_longitude else None,
-                'last_update': order.last_location_update.isoformat() if order.last_location_update else None,
-            } if order.current_latitude and order.current_longitude else None,
-        }
-        
-        return JsonResponse(response_data)
-        
+        order = Order.objects.select_related('compressed_track').get(id=order_id, user=request.user)
     except Order.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Order not found'}, status=404)
+    
+    if hasattr(order, 'compressed_track'):
+        track = track_payload(order.compressed_track)
+        compressed = True
+    else:
+        track = encode_raw_history(order)
+        compressed = False
+    
+    return JsonResponse({
+        'success': True,
+        'order_id': order.id,
+        'encoding': 'polyline6',
+        'compressed': compressed,
+        **track,
+    })
+
+@login_required(login_url='login')
+async def stream_order_location(request, order_id):
+    """Server-Sent Events stream pushing the order's position whenever it moves"""
+    # A WSGI server drains the whole (endless) iterator before sending
+    # anything, so only stream under ASGI; the page polls otherwise
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'success': False, 'error': 'Streaming is not available'}, status=406)
+    
+    user = await request.auser()
+    order = await Order.objects.filter(id=order_id, user=user).afirst()
+    if order is None:
+        return JsonResponse({'success': False, 'error': 'Order not found'}, status=404)
+    
+    # Subscribe before sending the snapshot so no update slips in between
+    subscription = broker.subscribe(order.id)
+    apply_buffered_position(order)
+    initial = encode_event({'success': True, **order.location_payload()})
+    
+    response = StreamingHttpResponse(
+        _location_events(order.id, subscription, initial),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
+
+async def _location_events(order_id, subscription, initial):
+    try:
+        yield initial
+        queue = subscription[1]
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield b': keep-alive\n\n'
+                continue
+            yield event
+    finally:
+        broker.unsubscribe(order_id, subscription)
 
 # ============ DISPATCH RIDER VIEWS ============
 
-@login_required(login_url='login')
+@role_required('dispatch', 'Access denied. This area is for dispatch riders only.')
+@replica_reads
 def dispatch_dashboard(request):
     """Dashboard for dispatch riders"""
-    # Check if user is dispatch rider
-    if not hasattr(request.user, 'profile') or request.user.profile.user_type != 'dispatch':
-        messages.error(request, 'Access denied. This area is for dispatch riders only.')
-        return redirect('dashboard')
-    
     profile = request.user.profile
     
     # Get assigned orders
-    assigned_orders = Order.objects.filter(assigned_dispatch=request.user).order_by('-date_created')
+    assigned_orders = Order.objects.filter(assigned_dispatch=request.user)
+    assigned_page, next_cursor = keyset_paginate(assigned_orders, request.GET.get('cursor'), ASSIGNED_PAGE_SIZE)
     
-    # Get available orders (pending, not assigned)
-    available_orders = Order.objects.filter(status='pending', assigned_dispatch__isnull=True).order_by('-date_created')
+    # Get available orders (pending, not assigned), nearest first when we know where the rider is
+    if profile.last_latitude is not None and profile.last_longitude is not None:
+        available_orders = available_orders_index.nearest(
+            float(profile.last_latitude), float(profile.last_longitude), AVAILABLE_ORDERS_LIMIT
+        )
+    else:
+        available_orders = Order.objects.filter(status='pending', assigned_dispatch__isnull=True).order_by('-date_created')[:AVAILABLE_ORDERS_LIMIT]
     
-    # Statistics
+    # Statistics, kept current by rider_stats
+    _, completed_today = today_stats(request.user.id)
     stats = {
+        'active_orders': profile.active_orders,
+        'completed_today': completed_today,
         'total_deliveries': profile.total_deliveries,
-        'active_orders': assigned_orders.filter(status='dispatched').count(),
-        'completed_today': assigned_orders.filter(status='delivered', date_created__date=timezone.now().date()).count(),
         'rating': profile.rating,
     }
     
     context = {
         'profile': profile,
-        'assigned_orders': assigned_orders[:10],  # Last 10
-        'available_orders': available_orders[:20],  # Top 20 available
+        'assigned_orders': assigned_page,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+        'available_orders': available_orders,
         'stats': stats,
     }
     
     return render(request, 'dispatch_dashboard.html', context)
 
-@login_required(login_url='login')
-def accept_order(request, order_id):
-    """Dispatch rider accepts an order"""
-    # Check if user is dispatch rider
-    if not hasattr(request.user, 'profile') or request.user.profile.user_type != 'dispatch':
-        messages.error(request, 'Only dispatch riders can accept orders.')
-        return redirect('dashboard')
+@role_required('dispatch', api=True)
+def nearby_orders(request):
+    """API endpoint listing the available orders closest to a dispatch rider"""
+    profile = request.user.profile
+    latitude = request.GET.get('latitude', profile.last_latitude)
+    longitude = request.GET.get('longitude', profile.last_longitude)
+    if latitude is None or longitude is None:
+        return JsonResponse({'success': False, 'error': 'Missing coordinates'}, status=400)
     
-    order = get_object_or_404(Order, id=order_id)
+    try:
+        latitude = float(latitude)
+        longitude = float(longitude)
+        k = min(int(request.GET.get('k', AVAILABLE_ORDERS_LIMIT)), MAX_NEARBY_ORDERS)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid parameters'}, status=400)
+    if k < 1:
+        return JsonResponse({'success': False, 'error': 'Invalid parameters'}, status=400)
+    # Also turns away nan and inf, which compare false against any bound
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return JsonResponse({'success': False, 'error': 'Invalid coordinates'}, status=400)
     
-    # Check if order is available
-    if order.assigned_dispatch is not None:
-        messages.error(request, 'This order has already been accepted by another dispatch rider.')
-        return redirect('dispatch_dashboard')
+    orders = available_orders_index.nearest(latitude, longitude, k)
+    return JsonResponse({
+        'success': True,
+        'orders': [
+            {
+                'order_id': order.id,
+                'name': order.name,
+                'distance_km': order.distance_km,
+                'pickup': {
+                    'address': order.pickup_address,
+                    'latitude': float(order.pickup_latitude),
+                    'longitude': float(order.pickup_longitude),
+                },
+            }
+            for order in orders
+        ],
+    })
+
+@login_required(login_url='login')
+def metrics(request):
+    """Per-URL latency histograms recorded by PerformanceMiddleware (staff only)"""
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'error': 'Access denied'}, status=403)
     
-    if order.status != 'pending':
-        messages.error(request, 'This order is no longer available.')
+    return JsonResponse({'success': True, 'endpoints': metrics_registry.snapshot()})
+
+@login_required(login_url='login')
+@replica_reads
+def fleet_snapshot(request):
+    """Live position of every dispatched order, as parallel arrays (staff only)"""
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'error': 'Access denied'}, status=403)
+
+    bbox = None
+    if request.GET.get('bbox'):
+        try:
+            bbox = tuple(float(value) for value in request.GET['bbox'].split(','))
+        except ValueError:
+            bbox = ()
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            return JsonResponse(
+                {'success': False, 'error': 'bbox must be min_lng,min_lat,max_lng,max_lat'}, status=400,
+            )
+
+    # Served from the in-memory fleet snapshot; the DB is only read to reload it
+    etag, body = fleet.payload(bbox)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@role_required('dispatch', 'Only dispatch riders can accept orders.')
+def accept_order(request, order_id):
+    """Dispatch rider accepts an order"""
+    if not claim_order(order_id, request.user):
+        order = get_object_or_404(Order, id=order_id)
+        if order.assigned_dispatch_id is not None:
+            messages.error(request, 'This order has already been accepted by another dispatch rider.')
+        else:
+            messages.error(request, 'This order is no longer available.')
         return redirect('dispatch_dashboard')
     
-    # Assign order to dispatch rider
-    order.assigned_dispatch = request.user
-    order.status = 'dispatched'
-    order.accepted_at = timezone.now()
-    order.save()
-    
-    messages.success(request, f'Order #{order.id} accepted! Start your delivery.')
-    return redirect('dispatch_tracking', order_id=order.id)
+    messages.success(request, f'Order #{order_id} accepted! Start your delivery.')
+    return redirect('dispatch_tracking', order_id=order_id)
 
-@login_required(login_url='login')
+@role_required('dispatch')
 def dispatch_tracking(request, order_id):
     """Dispatch rider tracking interface for active delivery"""
-    # Check if user is dispatch rider
-    if not hasattr(request.user, 'profile') or request.user.profile.user_type != 'dispatch':
-        messages.error(request, 'Access denied.')
-        return redirect('dashboard')
-    
     order = get_object_or_404(Order, id=order_id, assigned_dispatch=request.user)
     
     context = {
@@ -337,27 +573,23 @@ def dispatch_tracking(request, order_id):
     
     return render(request, 'dispatch_tracking.html', context)
 
-@login_required(login_url='login')
+@role_required('dispatch')
 def complete_delivery(request, order_id):
     """Mark delivery as complete"""
-    # Check if user is dispatch rider
-    if not hasattr(request.user, 'profile') or request.user.profile.user_type != 'dispatch':
-        messages.error(request, 'Access denied.')
-        return redirect('dashboard')
-    
     order = get_object_or_404(Order, id=order_id, assigned_dispatch=request.user)
     
-    if order.status == 'delivered':
+    # Conditional UPDATE so a double submit counts the delivery once
+    delivered_at = timezone.now()
+    completed = Order.objects.filter(id=order.id, status='dispatched').update(status='delivered', delivered_at=delivered_at)
+    if not completed:
         messages.info(request, 'This order is already marked as delivered.')
         return redirect('dispatch_dashboard')
     
     order.status = 'delivered'
-    order.save()
-    
-    # Update dispatch rider stats
-    profile = request.user.profile
-    profile.total_deliveries += 1
-    profile.save()
+    order.delivered_at = delivered_at
+    refresh_snapshot(apply_buffered_position(order))  # update() skips post_save
+    fleet.discard(order.id)
+    record_delivered(request.user.id)
     
     messages.success(request, f'Order #{order.id} marked as delivered! Great job!')
     return redirect('dispatch_dashboard')
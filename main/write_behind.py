@@ -0,0 +1,143 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Optional write-behind mode for location ingestion (LOCATION_WRITE_BEHIND).
+#
+# Accepted fixes are held in memory and written by a background thread every
+# LOCATION_FLUSH_INTERVAL seconds, or straight away once LOCATION_FLUSH_SIZE
+# fixes are waiting. A flush is one transaction holding one bulk insert into
+# the history table plus one UPDATE for the orders and one for their riders,
+# however many fixes and orders it covers. A flush that fails keeps its fixes
+# for the next attempt. Readers overlay the newest buffered position through
+# ingestion.apply_buffered_position, and the buffer is drained at exit.
+#
+# Fixes still in memory are lost if the process is killed outright, so only
+# enable this where a few seconds of rider history may be dropped.
+
+
+class LocationBuffer:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._latest = {}
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._counters = {
+            'fixes_buffered': 0,
+            'fixes_written': 0,
+            'flushes': 0,
+            'write_queries': 0,
+        }
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'LOCATION_WRITE_BEHIND', False)
+
+    def add(self, fixes):
+        with self._lock:
+            self._pending.extend(fixes)
+            for fix in fixes:
+                newest = self._latest.get(fix.order_id)
+                if newest is None or fix.timestamp >= newest.timestamp:
+                    self._latest[fix.order_id] = fix
+            self._counters['fixes_buffered'] += len(fixes)
+            pending = len(self._pending)
+        self._ensure_flusher()
+        if pending >= getattr(settings, 'LOCATION_FLUSH_SIZE', 500):
+            self._wakeup.set()
+
+    def latest(self, order_id):
+        """Newest fix for the order that has not been written yet"""
+        if not self._latest:
+            return None
+        return self._latest.get(order_id)
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def stats(self):
+        """
+        Counters since start. Writing fixes one by one costs two statements per
+        fix, so 2 * fixes_written / write_queries is the write reduction.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            counters['pending'] = len(self._pending)
+        if counters['write_queries']:
+            counters['write_reduction'] = round(2 * counters['fixes_written'] / counters['write_queries'], 1)
+        return counters
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of fixes written"""
+        from .ingestion import write_fixes
+        from .models import Order
+
+        with self._flush_lock:
+            with self._lock:
+                fixes, self._pending = self._pending, []
+            if not fixes:
+                return 0
+
+            try:
+                orders = Order.objects.in_bulk({fix.order_id for fix in fixes})
+                # Orders deleted while their fixes waited have nothing to write to
+                fixes = [fix for fix in fixes if fix.order_id in orders]
+                with transaction.atomic():
+                    moved = write_fixes(fixes, orders) if fixes else []
+            except Exception:
+                # The transaction rolled back, so none of these fixes were
+                # written: put them all back in front of anything that
+                # arrived meanwhile
+                with self._lock:
+                    self._pending[:0] = fixes
+                raise
+
+            with self._lock:
+                for fix in fixes:
+                    if self._latest.get(fix.order_id) is fix:
+                        del self._latest[fix.order_id]
+                self._counters['fixes_written'] += len(fixes)
+                self._counters['flushes'] += 1
+                self._counters['write_queries'] += 2 + bool(any(order.assigned_dispatch_id for order in moved))
+
+            logger.debug('Flushed %d fixes for %d orders', len(fixes), len(orders))
+            return len(fixes)
+
+    def _ensure_flusher(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='location-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(getattr(settings, 'LOCATION_FLUSH_INTERVAL', 2.0))
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Location flush failed; will retry')
+            finally:
+                close_old_connections()
+
+
+location_buffer = LocationBuffer()
+
+
+@atexit.register
+def _drain():
+    if location_buffer.pending_count():
+        try:
+            location_buffer.flush()
+        except Exception:
+            logger.exception('Could not drain %d buffered fixes at exit', location_buffer.pending_count())